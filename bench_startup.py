@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import json
+import subprocess
+import sys
+from statistics import median
+
+# Modules which should only be imported when pre-processing, never on the playback path.
+HEAVY_MODULES = ['numpy', 'pandas', 'tqdm', 'matplotlib', 'data']
+
+# Run in a fresh interpreter each time, so nothing is already cached in sys.modules.
+SCRIPT = '''
+import json, sys
+from time import perf_counter
+time_start = perf_counter()
+import manager
+time_import = perf_counter()
+data = manager.loadData(sys.argv[1]) if len(sys.argv) > 1 else None
+time_load = perf_counter()
+print(json.dumps({'import': time_import - time_start, 'load': time_load - time_import,
+                  'heavy': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def bench_startup(data_file=None, repeats=10):
+    ''' Times how long a fresh interpreter takes to import manager and, if a file is
+        supplied, to load a pre-processed timeline, i.e. the start-up cost of playback. '''
+
+    assert isinstance(repeats, int)
+    assert repeats > 0
+
+    args = [sys.executable, '-c', SCRIPT] + ([data_file] if data_file is not None else [])
+
+    results = []
+
+    for _ in range(repeats):
+        output = subprocess.run(args, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    import_times = [r['import'] for r in results]
+    load_times = [r['load'] for r in results]
+
+    print(f'Import manager:  median {median(import_times):.4f}s  min {min(import_times):.4f}s  ({repeats} runs)')
+
+    if data_file is not None:
+        print(f'Load timeline:   median {median(load_times):.4f}s  min {min(load_times):.4f}s')
+
+    heavy = results[-1]['heavy']
+
+    if heavy:
+        print('Warning: heavy modules imported on the playback path:', ', '.join(heavy))
+    else:
+        print('No heavy modules imported on the playback path.')
+
+    return results
+
+
+if __name__ == '__main__':
+    bench_startup(sys.argv[1] if len(sys.argv) > 1 else None)
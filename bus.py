@@ -0,0 +1,118 @@
+from time import sleep, time
+
+from smbus import SMBus
+
+from parameters import I2C_MULTIPLEXER_ID, BUS_RETRIES_MAX, BUS_BACKOFF_INITIAL, BUS_BACKOFF_MAX, \
+                       BUS_BREAKER_THRESHOLD, BUS_BREAKER_COOLDOWN, BUS_BREAKER_COOLDOWN_MAX
+
+
+class DeviceUnavailable(OSError):
+    ''' Raised instead of writing to a device which has been failing, until it is due to be tried again. '''
+
+
+class DeviceHealth:
+    ''' Error counts and circuit breaker state of one device. The breaker is closed (writes go ahead) until
+        BUS_BREAKER_THRESHOLD writes in a row fail. It then opens and the device is left alone until retry_after,
+        when a single write is let through as a probe (half open). If that works the breaker closes again,
+        otherwise it reopens for twice as long. '''
+
+    __slots__ = ('errors', 'failures', 'cooldown', 'retry_after')
+
+    def __init__(self):
+        self.errors = 0  # Total failed attempts, retries included.
+        self.failures = 0  # Failed writes in a row, after retrying.
+        self.cooldown = BUS_BREAKER_COOLDOWN
+        self.retry_after = 0.0  # When can the device next be written to? Only in the future while the breaker is open.
+
+    @property
+    def is_open(self):
+        return self.failures >= BUS_BREAKER_THRESHOLD
+
+
+class ResilientBus(SMBus):
+    ''' An SMBus which retries failed writes with exponential backoff, and stops writing to devices that keep
+        failing for a while, so one flaky display doesn't stall or stop the others.
+        Devices are told apart by multiplexer channel as well as address, as the same address can be on several
+        channels. The multiplexer itself is only retried, it is never left alone as every display needs it.
+        Reads are left as they are, as they're used to probe for devices where failing is expected. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.channel = None  # Which multiplexer channel was last activated?
+        self.health = {}  # (channel, address) -> DeviceHealth.
+
+    def get_health(self, address):
+        key = (None if address == I2C_MULTIPLEXER_ID else self.channel, address)
+
+        if key not in self.health:
+            self.health[key] = DeviceHealth()
+
+        return self.health[key]
+
+    def get_error_counts(self):
+        ''' Returns a dict of (channel, address) -> number of failed attempts, for every device which has failed. '''
+
+        return {key: health.errors for key, health in self.health.items() if health.errors > 0}
+
+    def call(self, write, address, *args):
+        ''' Makes a write to a device, retrying if it fails. Any OSError raised has a retry_after attribute, the
+            time at which it is worth writing to the device again. '''
+
+        health = self.get_health(address)
+        breaker = address != I2C_MULTIPLEXER_ID
+
+        probing = False
+
+        if breaker and health.is_open:
+            if time() < health.retry_after:
+                error = DeviceUnavailable(f'Device {address:#x} on channel {self.channel} is failing, not trying again yet.')
+                error.retry_after = health.retry_after
+                raise error
+
+            probing = True  # Half open, just the one attempt to see if the device is back.
+
+        attempts = 1 if probing else 1 + BUS_RETRIES_MAX
+        backoff = BUS_BACKOFF_INITIAL
+
+        for attempt in range(attempts):
+            try:
+                result = write(address, *args)
+            except OSError as error:
+                health.errors += 1
+
+                if attempt + 1 < attempts:
+                    sleep(backoff)
+                    backoff = min(2.0 * backoff, BUS_BACKOFF_MAX)
+                    continue
+
+                health.failures += 1
+                error.retry_after = time()
+
+                if breaker and health.is_open:
+                    if probing:
+                        health.cooldown = min(2.0 * health.cooldown, BUS_BREAKER_COOLDOWN_MAX)
+
+                    health.retry_after = time() + health.cooldown
+                    error.retry_after = health.retry_after
+
+                raise
+
+            health.failures = 0
+            health.cooldown = BUS_BREAKER_COOLDOWN
+
+            return result
+
+    def write_byte(self, address, value):
+        result = self.call(super().write_byte, address, value)
+
+        if address == I2C_MULTIPLEXER_ID:
+            self.channel = value  # Writing to the multiplexer switches channel.
+
+        return result
+
+    def write_byte_data(self, address, command, value):
+        return self.call(super().write_byte_data, address, command, value)
+
+    def write_i2c_block_data(self, address, command, data):
+        return self.call(super().write_i2c_block_data, address, command, data)
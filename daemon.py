@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+import json
+import os
+import socket
+from argparse import ArgumentParser
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Event, Lock, Thread
+
+import manager
+from display import get_displays, set_global_orientation
+from parameters import DAEMON_SOCKET
+from timeline import get_animations, loadData
+
+# Example, to set up the displays once and then play any number of timelines without starting up again:
+#   python daemon.py --layout 4 4 --mirror &
+#   python daemon.py --send '{"command": "load", "file": "Processed_data/example1"}'
+#   python daemon.py --send '{"command": "play"}'
+#
+# Each command is one line of JSON, answered by one line of JSON with "ok" true or false (and then an "error"):
+#   {"command": "load", "file": FILE}   Stops playing and loads a stored timeline, clearing the displays.
+#   {"command": "play", "loops": N}     Plays from where it was paused, or from the start once finished. loops as in run.
+#   {"command": "pause"}                Stops playing, leaving the displays as they are.
+#   {"command": "seek", "time": T}      Shows the frames at data time T, and plays on from there if playing.
+#   {"command": "speed", "speed": S}    Changes the playback speed, from the current position.
+#   {"command": "stats"}                Where playback is, and the upload stats.
+#   {"command": "quit"}                 Clears the displays and stops the daemon.
+
+
+class Daemon:
+    ''' Owns the bus and displays for as long as it runs, with the display thread running throughout, so loading and
+        playing a timeline only costs what that takes. Playback itself is manager.data_manager, which is stopped (by
+        g_break) to pause, and carried on from manager.g_position. Commands are handled one at a time. '''
+
+    def __init__(self, animate=False):
+        assert isinstance(animate, bool)  # Should steady sequences of frames, e.g. fades, be uploaded once and played by the matrix?
+
+        self.animate = animate
+
+        self.data = []
+        self.data_file = ''
+        self.animations = None
+        self.speed = 1.0
+        self.loops = 1
+
+        self.thread_data = None
+        self.stopped = Event()  # Set to stop the display thread.
+        self.thread_display = Thread(target=manager.display_manager, args=(self.stopped,), name='Display')
+        self.thread_display.start()
+
+        self.lock = Lock()
+
+    @property
+    def playing(self):
+        return self.thread_data is not None and self.thread_data.is_alive()
+
+    def get_state(self):
+        if self.playing:
+            return 'playing'
+        elif len(self.data) == 0:
+            return 'idle'
+        elif manager.g_position[0] >= len(self.data):
+            return 'finished'
+        else:
+            return 'paused'
+
+    def play(self, loops=None):
+        if self.playing:
+            return
+
+        if loops is not None:
+            assert isinstance(loops, int)
+            assert loops >= 0, 'Loops should be >= 0.'
+            self.loops = loops
+
+        if manager.g_position[0] >= len(self.data):  # Finished, so start again.
+            manager.queue_clear_frames()
+            manager.g_position = (0, None)
+
+        start, start_time = manager.g_position
+
+        manager.g_break = False
+        manager.g_stop.clear()
+
+        self.thread_data = Thread(target=manager.data_manager,
+                                  args=(self.data, self.animations, self.speed, start, start_time, self.loops), name='Data')
+        self.thread_data.start()
+
+    def pause(self):
+        if self.thread_data is not None:
+            manager.stop_playback()
+            self.thread_data.join()  # Straight away, leaving the events not yet due to carry on from.
+            self.thread_data = None
+
+    def load(self, data_file):
+        assert isinstance(data_file, str)
+
+        self.pause()
+
+        data = loadData(data_file)
+
+        self.animations = get_animations(data, size=manager.g_displays[0].size) if self.animate else None
+        self.data = data
+        self.data_file = data_file
+
+        manager.queue_clear_frames()
+        manager.g_position = (0, None)
+
+    def seek(self, start_time):
+        assert isinstance(start_time, (float, int))
+        assert len(self.data) > 0, 'No timeline loaded.'
+
+        playing = self.playing
+
+        self.pause()
+
+        manager.g_position = (manager.seek(self.data, start_time, self.data_file), start_time)
+
+        if playing:
+            self.play()
+
+    def set_speed(self, speed):
+        assert isinstance(speed, (float, int))
+        assert speed > 0.0, 'Speed should be > 0.0.'
+
+        playing = self.playing
+
+        self.pause()
+
+        self.speed = speed
+
+        if playing:
+            self.play()
+
+    def get_stats(self):
+        stats = manager.get_upload_stats()
+
+        n, data_time = manager.g_position
+
+        return {'state': self.get_state(), 'file': self.data_file, 'events': len(self.data), 'next_event': n,
+                'data_time': data_time, 'speed': self.speed, 'loops': self.loops,
+                'frames_dropped': stats['frames_dropped'], 'worst_wait': stats['worst_wait'],
+                'bus_errors': [{'channel': channel, 'address': address, 'errors': errors}
+                               for (channel, address), errors in sorted(stats['bus_errors'].items(), key=str)]}
+
+    def stop(self):
+        ''' Stops playing, then the display thread, which clears the displays as it finishes. '''
+
+        self.pause()
+        self.stopped.set()
+        self.thread_display.join()
+
+    def handle(self, request):
+        ''' Carries out one command and returns the reply. '''
+
+        command = request.get('command')
+
+        with self.lock:
+            if command == 'load':
+                self.load(request['file'])
+            elif command == 'play':
+                self.play(request.get('loops'))
+            elif command == 'pause':
+                self.pause()
+            elif command == 'seek':
+                self.seek(request['time'])
+            elif command == 'speed':
+                self.set_speed(request['speed'])
+            elif command == 'stats':
+                return dict(ok=True, **self.get_stats())
+            elif command == 'quit':
+                self.stop()
+            else:
+                return {'ok': False, 'error': f'Unknown command {command!r}.'}
+
+            return {'ok': True, 'state': self.get_state()}
+
+
+class CommandHandler(StreamRequestHandler):
+    ''' Answers each line of JSON sent over a connection, until the client closes it. '''
+
+    def handle(self):
+        for line in self.rfile:
+            request = {}
+
+            try:
+                request = json.loads(line)
+                assert isinstance(request, dict), 'Command should be a JSON object.'
+                reply = self.server.daemon.handle(request)
+            except Exception as error:  # Bad commands are reported back, the daemon carries on.
+                reply = {'ok': False, 'error': f'{type(error).__name__}: {error}'}
+
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+
+            if reply['ok'] and request.get('command') == 'quit':
+                Thread(target=self.server.shutdown).start()  # Can't wait for the server to stop from inside it.
+                break
+
+
+def serve(daemon, socket_file=DAEMON_SOCKET):
+    ''' Answers commands on the Unix socket until told to quit. '''
+
+    if os.path.exists(socket_file):  # Left behind by a daemon which didn't finish cleanly.
+        os.remove(socket_file)
+
+    with ThreadingUnixStreamServer(socket_file, CommandHandler) as server:
+        server.daemon_threads = True
+        server.daemon = daemon
+
+        print(f'Listening on {socket_file}')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            daemon.stop()
+
+    os.remove(socket_file)
+
+
+def send_command(request, socket_file=DAEMON_SOCKET):
+    ''' Sends one command (a dict) to a running daemon and returns its reply. '''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_file)
+        connection.sendall((json.dumps(request) + '\n').encode())
+
+        with connection.makefile() as f:
+            return json.loads(f.readline())
+
+
+def main(args=None):
+    parser = ArgumentParser(description='Keep the displays set up and play timelines on them as commanded over a Unix socket.')
+    parser.add_argument('--socket', default=DAEMON_SOCKET, help=f'Unix socket to listen on, or send to (default: {DAEMON_SOCKET}).')
+    parser.add_argument('--send', default=None, help='Send this JSON command to a running daemon and print its reply, rather than running one.')
+    parser.add_argument('--layout', type=int, nargs='+', default=None, help='Number of displays in each composite display.')
+    parser.add_argument('--mirror', action='store_true', help='Reuse displays as mirrors if there are not enough for the layout.')
+    parser.add_argument('--animate', action='store_true', help='Upload steady sequences of frames, e.g. fades, in one go.')
+    parser.add_argument('--live', action='store_true', help='Publish every uploaded frame for plot_displays.py --live.')
+
+    args = parser.parse_args(args)
+
+    if args.send is not None:
+        print(json.dumps(send_command(json.loads(args.send), args.socket)))
+        return
+
+    layout = None if args.layout is None else tuple(args.layout)
+
+    # All the slow setting up, done once.
+    bus = manager.get_bus()
+    displays = get_displays(bus, layout=layout, mirror=args.mirror)
+    set_global_orientation(bus, displays)
+
+    manager.initialise(layout, bus, displays, mirror=args.mirror)
+
+    if args.live:
+        from live import LiveFrames
+
+        manager.g_live = LiveFrames.create(max(display.ID for display in displays) + 1, size=displays[0].size)
+
+    daemon = Daemon(animate=args.animate)
+
+    serve(daemon, args.socket)
+
+    if manager.g_live is not None:
+        manager.g_live.close()
+
+    manager.reset()
+
+
+if __name__ == '__main__':
+    main()
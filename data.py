@@ -1,14 +1,19 @@
 from copy import deepcopy
-from numpy import loadtxt, arctan2, inf, where, zeros
+from itertools import chain
+from numpy import loadtxt, arange, arctan2, argsort, array, ceil, concatenate, cumsum, diff, floor, fromiter, inf, isfinite, isin, isnan, lexsort, maximum, minimum, repeat, searchsorted, split, where, zeros
+import pandas as pd
 from tqdm import tqdm
-from display import Display, get_display_ID
+from display import Display, get_display_ID, get_display_IDs
+from stats import get_hit_stats, get_update_stats, save_stats
+from timeline import Event, storeData, loadData  # Event, storeData and loadData live in timeline so playback doesn't need this module.
+from profiling import stage
 from parameters import MODES, MODE_DEFAULT, \
                        PHASE_MODE_TICKS, \
                        COLOR_DEFAULT, COLOR_GRADIENT_DEFAULT, COLOR_METHODS, COLOR_METHOD_DEFAULT, \
                        ENERGY_METHODS, ENERGY_METHOD_DEFAULT, ENERGY_TICK_RATE_DEFAULT, \
                        EVENT_TIME_DIFFERENCE_TOLERANCE, GRADIENT_DELAY, GRADIENT_DELAY_PHASE, EXAMPLE_DATA, \
-                       PI
-from utility import get_color_from_gradient, get_num_ticks, get_quantity, get_rate, PhaseBin, get_phase_bin
+                       PI, VALIDATE_DEFAULT, DATA_COLUMNS, DATA_DTYPES
+from utility import get_color_from_gradient, get_colors_from_gradient, get_peak_memory, get_rate, PhaseBin, get_phase_bin
 import math
 
 def process_data(file_,
@@ -19,7 +24,9 @@ def process_data(file_,
                  energy_tick_rate=ENERGY_TICK_RATE_DEFAULT,
                  gradient_delay=GRADIENT_DELAY,
                  color_gradient=COLOR_GRADIENT_DEFAULT,
-                 normalise=True,mirror=False):
+                 normalise=True,mirror=False,
+                 validate=VALIDATE_DEFAULT,
+                 stats_file=None):
 
     assert isinstance(file_, str)
     assert all(isinstance(display, Display) for display in displays)
@@ -31,6 +38,8 @@ def process_data(file_,
     assert all(isinstance(energy, (float, int)) and isinstance(color, int) for energy, color in zip(*color_gradient))
     assert isinstance(normalise, bool)  # Do we want to normalise the time of the data to have on avg. 100 data points per 5 sec?
     assert isinstance(mirror, bool)  # Do we want half the displays to "mirror" the other half? (Used when two composite displays are back-to-back)
+    assert isinstance(validate, bool)  # Do we want to check the output of each stage? The DataPoints and Events don't check themselves.
+    assert stats_file is None or isinstance(stats_file, str)  # Where to save the hit, energy and update counts of every pixel, if anywhere.
 
     mode = mode.strip().lower()
     color_method = color_method.strip().lower()
@@ -40,7 +49,12 @@ def process_data(file_,
     assert color_method in COLOR_METHODS, f'{color_method} is an unknown colour method.'
     assert energy_method in ENERGY_METHODS, f'{energy_method} is an unknown energy method.'
 
+    profile = stage('ingest').start()
     data_raw = process_file(file_, mode=mode, normalise=normalise)  # The raw data from file.
+    profile.stop(items=len(data_raw))
+
+    # The hits have to be counted before the energy methods update the data in place.
+    hit_stats = get_hit_stats(data_raw, displays) if stats_file is not None else None
 
     # Modes are just essentially a set of defined parameters.
     if mode == 'normal':
@@ -90,7 +104,7 @@ def process_data(file_,
 	# than creating a lsit and spliting it in two.
      
         data_phase = data_raw.loc[data_raw['side']==0]
-        data_raw = data_raw.loc[data_raw['side']==1]               
+        data_raw = data_raw.loc[data_raw['side']==1].copy()  # Its own frame, as it is sorted and updated in place from here on.
     
 
         # Let's go and process the data_raw as normal, and then tie in the phase data after.
@@ -115,204 +129,215 @@ def process_data(file_,
         # The second half of the data is to be display on side 1 as it would in 'normal' mode.
 
         data_phase = data_raw[:len(data_raw)//2]
-        data_raw = data_raw[len(data_raw)//2:]
+        data_raw = data_raw[len(data_raw)//2:].copy()  # Its own frame rather than a view of the one data_phase is from, as it is sorted and updated in place from here on.
 
         # Let's go and process the data_raw as normal, and then tie in the phase data after.
 
+    profile = stage(f'{energy_method} data').start()
+
     if color_method == 'energy':  # Base the colouring on the energy of the detection.
 
         # Collect the list of DataPoints, accounting for the energy method.
         if energy_method == 'accumulate':
-            data_raw = get_energy_accum_data(data_raw)
-            data_processed = []
-            # BT: Applying the function to convert pandas dataframe to datapoint class row-wise
-            data_processed = data_raw.apply(dframe_to_dpclass,starttime=data_raw['time'].min(), endtime=data_raw['time'].max(),axis=1)
+            # The accumulated data stays as a dataframe, the events are then made from its columns directly.
+            data_processed = get_energy_accum_data(data_raw)
+
+        elif energy_method == 'tick' and mode == 'normal':
+            # Overlapping hits on a pixel are merged by get_energy_decay_events as it creates the events.
+            data_processed = data_raw
 
         elif energy_method == 'tick':
             data_processed = get_energy_tick_data(data_raw, gradient_delay=GRADIENT_DELAY_PHASE, phase_mode=mode=='phase')
+            data_processed = get_data_points(data_processed, gradient_delay=GRADIENT_DELAY_PHASE)
 
+            if validate:
+                validate_data_points(data_processed)
+
+    profile.stop(items=len(data_processed))
 
     # Before creating the events, we need to tie in some phase data first.
     if mode == 'phase':
-        # The data in data_raw comes in pairs, whereby we will display the phase of these pairs compared with the pairs in data_phase.
-        # We create a bin of phase differences.
-        # An exact arc will cut through 15 of the pixels on an 8x8 display. So we create 60 bins (one for each quadrant).
+        with stage('phase binning', items=len(data_processed)):
+            # The data in data_raw comes in pairs, whereby we will display the phase of these pairs compared with the pairs in data_phase.
+            # We create a bin of phase differences.
+            # An exact arc will cut through 15 of the pixels on an 8x8 display. So we create 60 bins (one for each quadrant).
 
-        phase_bins = []
-        num_bins = 60
+            phase_bins = []
+            num_bins = 60
 
-        for n in range(num_bins):
-            lbound = 2.0 * PI * (float(n)) / float(num_bins)
-            ubound = 2.0 * PI * (float(n+1)) / float(num_bins)
+            for n in range(num_bins):
+                lbound = 2.0 * PI * (float(n)) / float(num_bins)
+                ubound = 2.0 * PI * (float(n+1)) / float(num_bins)
 
-            phase_bins.append(PhaseBin(lbound, ubound))
+                phase_bins.append(PhaseBin(lbound, ubound))
 
-        # This will store the 'data points' of pixel changes for the phase side.
-        data_phase_processed = []
+            # This will store the 'data points' of pixel changes for the phase side.
+            data_phase_processed = []
 
-        # We store a count of how many bins are contributing to each pixel on the screen so we know whether to turn it off or not.
-        # TODO: this assumes 2x2 lots of 8x8 screens.
-        frame_counts = zeros((16, 16), dtype=int)
+            # We store a count of how many bins are contributing to each pixel on the screen so we know whether to turn it off or not.
+            # TODO: this assumes 2x2 lots of 8x8 screens.
+            frame_counts = zeros((16, 16), dtype=int)
 
-        for n in range(0, len(data_processed), 2):
+            for n in range(0, len(data_processed), 2):
 
-            # (x, y) co-ordinates.
-            A = (data_processed[n].x, data_processed[n].y)
-            B = (data_processed[n+1].x, data_processed[n+1].y)
-            C = (data_phase[n][2], data_phase[n][3])
-            D = (data_phase[n+1][2], data_phase[n+1][3])
+                # (x, y) co-ordinates.
+                A = (data_processed[n].x, data_processed[n].y)
+                B = (data_processed[n+1].x, data_processed[n+1].y)
+                C = (data_phase[n][2], data_phase[n][3])
+                D = (data_phase[n+1][2], data_phase[n+1][3])
 
-            phaseAB = float(arctan2(A[1]-B[1], A[0]-B[0], dtype=float))
-            phaseCD = float(arctan2(C[1]-D[1], C[0]-D[0], dtype=float))
+                phaseAB = float(arctan2(A[1]-B[1], A[0]-B[0], dtype=float))
+                phaseCD = float(arctan2(C[1]-D[1], C[0]-D[0], dtype=float))
 
-            # Get phase difference.
-            #phase_diff = phaseAB - phaseCD
-            # dot product
-            #print("pos",A,B,C,D)
-            #print("diff",A[0]-B[0],A[1]-B[1])
-            phase_diff = float((A[0]-B[0])*(C[0]-D[0]))
-            phase_diff = phase_diff/math.sqrt(float((A[0]-B[0])*(A[0]-B[0])+(A[1]-B[1])*(A[1]-B[1])))
-            phase_diff = phase_diff/math.sqrt(float((C[0]-D[0])*(C[0]-D[0])+(C[1]-D[1])*(C[1]-D[1])))
+                # Get phase difference.
+                #phase_diff = phaseAB - phaseCD
+                # dot product
+                #print("pos",A,B,C,D)
+                #print("diff",A[0]-B[0],A[1]-B[1])
+                phase_diff = float((A[0]-B[0])*(C[0]-D[0]))
+                phase_diff = phase_diff/math.sqrt(float((A[0]-B[0])*(A[0]-B[0])+(A[1]-B[1])*(A[1]-B[1])))
+                phase_diff = phase_diff/math.sqrt(float((C[0]-D[0])*(C[0]-D[0])+(C[1]-D[1])*(C[1]-D[1])))
 
-            # Ensure angle is between 0 and 2PI.
-            if phase_diff < 0.0:
-                phase_diff += 2.0 * PI
+                # Ensure angle is between 0 and 2PI.
+                if phase_diff < 0.0:
+                    phase_diff += 2.0 * PI
 
-            #### Ensures angle is between -PI and PI.
-            ###if phase_diff > PI:
-            ###    phase_diff -= 2.0 * PI
+                #### Ensures angle is between -PI and PI.
+                ###if phase_diff > PI:
+                ###    phase_diff -= 2.0 * PI
 
-            ###if phase_diff <= -PI:
-            ###    phase_diff += 2.0 * PI
+                ###if phase_diff <= -PI:
+                ###    phase_diff += 2.0 * PI
 
-            phase_bin = get_phase_bin(phase_bins, phase_diff)
+                phase_bin = get_phase_bin(phase_bins, phase_diff)
 
-            # Save a copy of what the frame looks like.
-            frame_counts_old = deepcopy(frame_counts)
+                # Save a copy of what the frame looks like.
+                frame_counts_old = deepcopy(frame_counts)
 
-            # Turn that pixel off.
-            frame_counts[phase_bin.y][phase_bin.x] -= 1
+                # Turn that pixel off.
+                frame_counts[phase_bin.y][phase_bin.x] -= 1
 
-            # Increment this phase bin.
-            phase_bin.count += 1
+                # Increment this phase bin.
+                phase_bin.count += 1
 
-            # Work out which phase bin has the highest count at the moment.
-            max_count = max([p.count for p in phase_bins])
+                # Work out which phase bin has the highest count at the moment.
+                max_count = max([p.count for p in phase_bins])
 
-            # Work out if the pixel displaying the x and y has changed.
-            phase_bin.determine_x_y(max_count)
+                # Work out if the pixel displaying the x and y has changed.
+                phase_bin.determine_x_y(max_count)
 
-            # Turn the new pixel on.
-            frame_counts[phase_bin.y][phase_bin.x] += 1
+                # Turn the new pixel on.
+                frame_counts[phase_bin.y][phase_bin.x] += 1
 
-            # Has anything on the frame changed?
-            frame_diff = frame_counts - frame_counts_old
+                # Has anything on the frame changed?
+                frame_diff = frame_counts - frame_counts_old
 
-            on_y, on_x = where(frame_diff > 0)
-            off_y, off_x = where(frame_diff < 0)
+                on_y, on_x = where(frame_diff > 0)
+                off_y, off_x = where(frame_diff < 0)
 
-            assert on_y.size == on_x.size == off_y.size == off_x.size, 'Error when creating phase diagram.'
+                assert on_y.size == on_x.size == off_y.size == off_x.size, 'Error when creating phase diagram.'
 
-            # If we have found a change, then create a data point for it if required.
-            if on_y.size == 1:
-                on_y, on_x = int(on_y), int(on_x)
-                off_y, off_x = int(off_y), int(off_x)
+                # If we have found a change, then create a data point for it if required.
+                if on_y.size == 1:
+                    on_y, on_x = int(on_y), int(on_x)
+                    off_y, off_x = int(off_y), int(off_x)
 
-                # Only turn the new pixel on, if the number of counts it had before was 0.
-                if frame_counts_old[on_y][on_x] == 0:
-                    data_phase_processed.append(DataPoint(on_x, on_y, side=0, energy=inf,
-                                                          start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
+                    # Only turn the new pixel on, if the number of counts it had before was 0.
+                    if frame_counts_old[on_y][on_x] == 0:
+                        data_phase_processed.append(DataPoint(on_x, on_y, side=0, energy=inf,
+                                                              start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
 
-                # Only turn the old pixel off, if the number of counts it has now is 0.
-                if frame_counts[off_y][off_x] == 0:
-                    data_phase_processed.append(DataPoint(off_x, off_y, side=0, energy=-inf,
-                                                          start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
+                    # Only turn the old pixel off, if the number of counts it has now is 0.
+                    if frame_counts[off_y][off_x] == 0:
+                        data_phase_processed.append(DataPoint(off_x, off_y, side=0, energy=-inf,
+                                                              start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
 
     # Before creating the events, we need to tie in some phase data first.
     if mode == 'scatter':
-        # The data in data_raw comes in pairs, whereby we will display the phase of these pairs compared with the pairs in data_phase.
-        # We create a bin of phase differences.
-        # An exact arc will cut through 15 of the pixels on an 8x8 display. So we create 60 bins (one for each quadrant).
+        with stage('scatter binning', items=len(data_processed)):
+            # The data in data_raw comes in pairs, whereby we will display the phase of these pairs compared with the pairs in data_phase.
+            # We create a bin of phase differences.
+            # An exact arc will cut through 15 of the pixels on an 8x8 display. So we create 60 bins (one for each quadrant).
+
+            phase_bins = []
+            num_bins = 60
 
-        phase_bins = []
-        num_bins = 60
+            for n in range(num_bins):
+                lbound = 2.0 * PI * (float(n)) / float(num_bins)
+                ubound = 2.0 * PI * (float(n+1)) / float(num_bins)
 
-        for n in range(num_bins):
-            lbound = 2.0 * PI * (float(n)) / float(num_bins)
-            ubound = 2.0 * PI * (float(n+1)) / float(num_bins)
+                phase_bins.append(PhaseBin(lbound, ubound))
 
-            phase_bins.append(PhaseBin(lbound, ubound))
+            # This will store the 'data points' of pixel changes for the phase side.
+            data_phase_processed = []
 
-        # This will store the 'data points' of pixel changes for the phase side.
-        data_phase_processed = []
+            # We store a count of how many bins are contributing to each pixel on the screen so we know whether to turn it off or not.
+            # TODO: this assumes 2x2 lots of 8x8 screens.
+            frame_counts = zeros((16, 16), dtype=int)
 
-        # We store a count of how many bins are contributing to each pixel on the screen so we know whether to turn it off or not.
-        # TODO: this assumes 2x2 lots of 8x8 screens.
-        frame_counts = zeros((16, 16), dtype=int)
+            for n in range(0, len(data_processed), 2):
 
-        for n in range(0, len(data_processed), 2):
+                # (x, y) co-ordinates.
+                A = (data_processed[n].x, data_processed[n].y)
+                B = (data_processed[n+1].x, data_processed[n+1].y)
+                C = (data_phase[n][2], data_phase[n][3])
+                D = (data_phase[n+1][2], data_phase[n+1][3])
 
-            # (x, y) co-ordinates.
-            A = (data_processed[n].x, data_processed[n].y)
-            B = (data_processed[n+1].x, data_processed[n+1].y)
-            C = (data_phase[n][2], data_phase[n][3])
-            D = (data_phase[n+1][2], data_phase[n+1][3])
+                phaseAB = float(arctan2(A[1]-B[1], A[0]-B[0], dtype=float))
+                phaseCD = float(arctan2(C[1]-D[1], C[0]-D[0], dtype=float))
 
-            phaseAB = float(arctan2(A[1]-B[1], A[0]-B[0], dtype=float))
-            phaseCD = float(arctan2(C[1]-D[1], C[0]-D[0], dtype=float))
+                # Get phase difference.
+                #phase_diff = phaseAB - phaseCD
+                # dot product
+                #print("pos",A,B,C,D)
+                #print("diff",A[0]-B[0],A[1]-B[1])
+                phase_diff = float((A[0]-B[0])*(C[0]-D[0]))
+                phase_diff = phase_diff/math.sqrt(float((A[0]-B[0])*(A[0]-B[0])+(A[1]-B[1])*(A[1]-B[1])))
+                phase_diff = phase_diff/math.sqrt(float((C[0]-D[0])*(C[0]-D[0])+(C[1]-D[1])*(C[1]-D[1])))
 
-            # Get phase difference.
-            #phase_diff = phaseAB - phaseCD
-            # dot product
-            #print("pos",A,B,C,D)
-            #print("diff",A[0]-B[0],A[1]-B[1])
-            phase_diff = float((A[0]-B[0])*(C[0]-D[0]))
-            phase_diff = phase_diff/math.sqrt(float((A[0]-B[0])*(A[0]-B[0])+(A[1]-B[1])*(A[1]-B[1])))
-            phase_diff = phase_diff/math.sqrt(float((C[0]-D[0])*(C[0]-D[0])+(C[1]-D[1])*(C[1]-D[1])))
+                phase_bin = get_phase_bin(phase_bins, phase_diff)
 
-            phase_bin = get_phase_bin(phase_bins, phase_diff)
+                # Save a copy of what the frame looks like.
+                frame_counts_old = deepcopy(frame_counts)
 
-            # Save a copy of what the frame looks like.
-            frame_counts_old = deepcopy(frame_counts)
+                # Turn that pixel off.
+                frame_counts[phase_bin.y][phase_bin.x] -= 1
 
-            # Turn that pixel off.
-            frame_counts[phase_bin.y][phase_bin.x] -= 1
+                # Increment this phase bin.
+                phase_bin.count += 1
 
-            # Increment this phase bin.
-            phase_bin.count += 1
+                # Work out which phase bin has the highest count at the moment.
+                max_count = max([p.count for p in phase_bins])
 
-            # Work out which phase bin has the highest count at the moment.
-            max_count = max([p.count for p in phase_bins])
+                # Work out if the pixel displaying the x and y has changed.
+                phase_bin.determine_x_y(max_count)
 
-            # Work out if the pixel displaying the x and y has changed.
-            phase_bin.determine_x_y(max_count)
+                # Turn the new pixel on.
+                frame_counts[phase_bin.y][phase_bin.x] += 1
 
-            # Turn the new pixel on.
-            frame_counts[phase_bin.y][phase_bin.x] += 1
+                # Has anything on the frame changed?
+                frame_diff = frame_counts - frame_counts_old
 
-            # Has anything on the frame changed?
-            frame_diff = frame_counts - frame_counts_old
+                on_y, on_x = where(frame_diff > 0)
+                off_y, off_x = where(frame_diff < 0)
 
-            on_y, on_x = where(frame_diff > 0)
-            off_y, off_x = where(frame_diff < 0)
+                assert on_y.size == on_x.size == off_y.size == off_x.size, 'Error when creating phase diagram.'
 
-            assert on_y.size == on_x.size == off_y.size == off_x.size, 'Error when creating phase diagram.'
+                # If we have found a change, then create a data point for it if required.
+                if on_y.size == 1:
+                    on_y, on_x = int(on_y), int(on_x)
+                    off_y, off_x = int(off_y), int(off_x)
 
-            # If we have found a change, then create a data point for it if required.
-            if on_y.size == 1:
-                on_y, on_x = int(on_y), int(on_x)
-                off_y, off_x = int(off_y), int(off_x)
+                    # Only turn the new pixel on, if the number of counts it had before was 0.
+                    if frame_counts_old[on_y][on_x] == 0:
+                        data_phase_processed.append(DataPoint(on_x, on_y, side=0, energy=inf,
+                                                              start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
 
-                # Only turn the new pixel on, if the number of counts it had before was 0.
-                if frame_counts_old[on_y][on_x] == 0:
-                    data_phase_processed.append(DataPoint(on_x, on_y, side=0, energy=inf,
-                                                          start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
+                    # Only turn the old pixel off, if the number of counts it has now is 0.
+                    if frame_counts[off_y][off_x] == 0:
+                        data_phase_processed.append(DataPoint(off_x, off_y, side=0, energy=-inf,
+                                                              start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
 
-                # Only turn the old pixel off, if the number of counts it has now is 0.
-                if frame_counts[off_y][off_x] == 0:
-                    data_phase_processed.append(DataPoint(off_x, off_y, side=0, energy=-inf,
-                                                          start_time=data_processed[n].start_time, gradient_delay=GRADIENT_DELAY_PHASE))
-                    
     #print(" ")
     #print("Colour method is ",color_method)
     #print("Energy method is ",energy_method)
@@ -322,6 +347,8 @@ def process_data(file_,
     #    numEvent += 1
     #    print("Data item ",numEvent," details: x,y ",event.x,event.y," side ",event.side," energy details ",event.energy,event.energy_tick_rate,event.ticks,event.gradient_delay,event.start_time,event.end_time)
     
+    profile = stage('events').start()
+
     if color_method == 'energy':  # Base the colouring on the energy of the detection.
 
         # Now turn the DataPoints into events, accounting for the energy method.
@@ -331,6 +358,8 @@ def process_data(file_,
                               [0])
             print(color_gradient)
             events = get_energy_accum_events(data_processed, displays, color_gradient)
+        elif energy_method == 'tick' and mode == 'normal':
+            events = get_energy_decay_events(data_processed, displays, color_gradient, gradient_delay=GRADIENT_DELAY_PHASE)
         elif energy_method == 'tick':
             events = get_energy_tick_events(data_processed, displays, color_gradient)
 
@@ -339,6 +368,11 @@ def process_data(file_,
 
         events += events_phase
 
+    profile.stop(items=len(events))
+
+    if validate:
+        validate_events(events, displays)
+
 
     #print(" ")
     #numEvent = 0
@@ -353,7 +387,11 @@ def process_data(file_,
     #    print(" ")
     
     # Make sure the events are in time order.
-    events = sorted(events)
+    with stage('sort', items=len(events)):
+        events = sort_events(events)
+
+    if validate:
+        validate_events(events, displays, ordered=True)
     #print(" ")
     #numEvent = 0
     #for event in events:
@@ -368,29 +406,18 @@ def process_data(file_,
 
     # All events at the moment are individual pixel updates.
     # Let's group multiple pixel updates together into a single event, IF they are very close together in time.
-    events = group_events(events)
+    # The accumulate events are already grouped as they are made, so that would change nothing unless phase events were added.
+    if not (color_method == 'energy' and energy_method == 'accumulate' and mode != 'phase'):
+        with stage('grouping', items=len(events)):
+            events = group_events(events)
 
-    # Let's construct the pixel map for one display
-    rows, cols = (8, 8)
+    if validate:
+        validate_events(events, displays, ordered=True)
 
-    for ID in range(4):
-        # Create and initialise to zero
-        pixelmap = [[0 for i in range(cols)] for j in range(rows)]
+    if stats_file is not None:
+        hits, energy = hit_stats
+        save_stats(stats_file, {'hits': hits, 'energy': energy, 'updates': get_update_stats(events, displays)})
 
-        for event in events:
-            #print("Display IDs",event.display_IDs)
-            #print("x",event.x_values)
-            #print("y",event.y_values)
-            for plot in range(len(event.x_values)):
-                if (event.display_IDs[plot]==ID):
-                    pixelmap[event.x_values[plot]][event.y_values[plot]]+=1
-
-        print(" ")
-        print("Pixel map for display ",ID)
-        for j in range(rows):
-            print(pixelmap[j])
-
-            #print(" ")
     #numEvent = 0
     #for event in events:
     #    numEvent += 1
@@ -402,6 +429,8 @@ def process_data(file_,
     #    print("start_time  ",event.start_time)
     #    print(" ")
 
+    print(f'Peak memory use while processing: {get_peak_memory():.1f} MB')
+
     return events
 
 
@@ -410,16 +439,12 @@ def process_file(file_, mode=MODE_DEFAULT, normalise=False):
     assert isinstance(mode, str)
     assert isinstance(normalise, bool)  # Do we want to normalise the time data to have on avg. 100 data points per 5 sec?
 
-    # create pandas dataframe from csv file containing all the data points
-    data = pd.read_csv(file_, sep=',')
+    # create pandas dataframe from the file containing all the data points
+    data = read_data_file(file_)
 
     assert len(data.shape) == 2, 'Need more than 1 data point.'  # Dealing with numpy's awkward shape size.
     assert data.shape[0] > 0, f'No data in file {file_}.'
-    assert data.shape[1] == 6, 'Number of columns of data should be 6.'
 
-   # BT:  give the datframe columns some sensible lables 
-    data.columns = ['time', 'ID', 'side', 'x', 'y', 'energy']
-    
   # BT: all these assresions now take one operastion rather than several loops  
     assert data['time'].min() >= 0.0, 'Data point with time < 0.'
     assert data['side'].isin([0,1]).all(), 'Data point with side not equal to 0 or 1.'  # TODO: relax this condition?
@@ -444,21 +469,34 @@ def process_file(file_, mode=MODE_DEFAULT, normalise=False):
         # The phase data comes first and then the data to display normally.
 
         # I belive this line does the trick, basically sort all the values by both side and time
-        data = data.sort_values(['side','time'])
+        data.sort_values(['side','time'], inplace=True)
 
     if normalise:
         num_data_points = data.shape[0]
         factor = 5.0 * float(num_data_points) / 5000.0
-        data['time'] = factor * (data['time'] - data['time'].min())/(data['time'].max() - data['time'].min())
+        t_min, t_max = data['time'].min(), data['time'].max()
+        data['time'] -= t_min
+        data['time'] *= factor / (t_max - t_min)
 
     return data
 
 
+def sort_events(events):
+    ''' Returns the events in time order. Events with the same start time keep their order, as with sorted(), but
+        the sort is done on an array of the start times rather than by comparing Events. Most of the time the
+        events are already in order (each energy method makes them in order), in which case there's nothing to do. '''
+
+    start_times = fromiter((event.start_time for event in events), dtype=float, count=len(events))
+
+    if (diff(start_times) >= 0.0).all():
+        return list(events)
+
+    return [events[n] for n in argsort(start_times, kind='stable')]
+
+
 def group_events(events):
     ''' Group events together that occur within the EVENT_TIME_DIFFERENCE_TOLERANCE. '''
 
-    assert all(isinstance(e, Event) for e in events)
-
     grouped_events = []
 
     n = 0  # Manual counter, so we can avoid already-processed events.
@@ -495,13 +533,107 @@ def group_events(events):
     return grouped_events
 
 
+def get_grouped_events(times, x_values, y_values, colors, display_IDs):
+    ''' Array version of group_events. Takes time-ordered arrays of individual pixel updates and
+        groups together those that occur within the EVENT_TIME_DIFFERENCE_TOLERANCE into events. '''
+
+    events = []
+
+    n = 0  # Index of the first pixel update of the current group.
+
+    while n < len(times):
+        # The group runs up to the first update which is not close enough in time to the start of the group.
+        m = max(int(searchsorted(times, times[n] + EVENT_TIME_DIFFERENCE_TOLERANCE, side='left')), n + 1)
+
+        events.append(Event(x_values[n:m].tolist(), y_values[n:m].tolist(), colors[n:m].tolist(),
+                            display_IDs[n:m].tolist(), float(times[n])))
+
+        n = m
+
+    return events
+
+
+def get_data_points(data, gradient_delay=GRADIENT_DELAY):
+    ''' Turns the processed dataframe into a list of DataPoints. The columns are converted to lists
+        first, so this is one pass over plain Python values rather than a pass over dataframe rows. '''
+
+    columns = ['x', 'y', 'side', 'energy', 'energy_tick_rate', 'num_ticks']
+    x, y, side, energy, energy_tick_rate, num_ticks = (data[c].to_numpy().tolist() for c in columns)
+
+    start_time = data['start_time'].to_numpy(dtype=float).tolist() if 'start_time' in data else data['time'].to_numpy(dtype=float).tolist()
+    end_time = data['end_time'].to_numpy(dtype=float).tolist() if 'end_time' in data else [inf] * len(start_time)
+
+    return [DataPoint(*d, gradient_delay=gradient_delay, start_time=t0, end_time=t1)
+            for *d, t0, t1 in zip(x, y, side, energy, energy_tick_rate, num_ticks, start_time, end_time)]
+
+
+def validate_data_points(data_points):
+    ''' Checks a whole stage of DataPoints at once, rather than each DataPoint checking itself when created. '''
+
+    assert all(isinstance(d, DataPoint) for d in data_points)
+
+    if len(data_points) == 0:
+        return
+
+    x = array([d.x for d in data_points])
+    y = array([d.y for d in data_points])
+    side = array([d.side for d in data_points])
+    ticks = array([d.ticks for d in data_points])
+    energy = array([d.energy for d in data_points], dtype=float)
+    start_time = array([d.start_time for d in data_points], dtype=float)
+
+    assert all(a.dtype.kind in 'iu' for a in (x, y, side, ticks)), 'DataPoint with non integer x, y, side or ticks.'
+    assert (x >= 0).all() and (y >= 0).all(), 'DataPoint with pixel < 0.'
+    assert (side >= 0).all(), 'DataPoint with side < 0.'
+    assert (ticks >= 0).all(), 'DataPoint with ticks < 0.'
+    assert not isnan(energy).any(), 'DataPoint with energy that is not a number.'
+    assert isfinite(start_time).all(), 'DataPoint with start time that is not finite.'
+
+
+def validate_events(events, displays, ordered=False):
+    ''' Checks a whole stage of Events at once, rather than each Event checking itself when created.
+        If ordered is True, the events must also be in time order. '''
+
+    assert all(isinstance(e, Event) for e in events)
+
+    if len(events) == 0:
+        return
+
+    lengths = array([(len(e.x_values), len(e.y_values), len(e.colors), len(e.display_IDs)) for e in events])
+    assert (lengths == lengths[:, :1]).all(), 'Event with differing numbers of x, y, colour and display ID values.'
+
+    x_values = array(list(chain.from_iterable(e.x_values for e in events)))
+    y_values = array(list(chain.from_iterable(e.y_values for e in events)))
+    colors = array(list(chain.from_iterable(e.colors for e in events)))
+    display_IDs = array(list(chain.from_iterable(e.display_IDs for e in events)))
+
+    if x_values.size > 0:
+        size = displays[0].size
+
+        assert all(a.dtype.kind in 'iu' for a in (x_values, y_values, colors, display_IDs)), 'Event with non integer values.'
+        assert ((x_values >= 0) & (x_values < size)).all(), 'Event with x value outside of frame range.'
+        assert ((y_values >= 0) & (y_values < size)).all(), 'Event with y value outside of frame range.'
+        assert ((colors >= 0) & (colors <= 255)).all(), 'Event with colour number not between 0 and 255.'
+        assert isin(display_IDs, [display.ID for display in displays]).all(), 'Event for a display which does not exist.'
+
+    start_times = array([e.start_time for e in events], dtype=float)
+
+    assert isfinite(start_times).all(), 'Event with start time that is not finite.'
+
+    if ordered:
+        assert (diff(start_times) >= 0.0).all(), 'Events are not in time order.'
+
+
 def get_energy_accum_data(data_raw):
     ''' Takes in the raw data, and returns the organised data points. This initially
         gets the data points with their own energy. It then ensures the data is sorted
         and the energies of the pixels updated to be accumulative. '''
 
 
-    data_processed = data_raw.sort_values('time') # Sorted based on start_time. BT: probably not necessary
+    data_processed = data_raw  # The energies are updated in place, the raw data isn't needed afterwards.
+
+    if not data_processed['time'].is_monotonic_increasing:
+        data_processed.sort_values('time', kind='stable', inplace=True)  # Sorted based on start_time.
 
     # We need to make the energy of the data point equal to itself plus the previous energy of the pixel.
     # If there are no hits of the pixel before data point, then its energy is left unchanged.
@@ -514,15 +646,15 @@ def get_energy_accum_data(data_raw):
 
 def get_energy_tick_data(data_raw, energy_tick_rate=ENERGY_TICK_RATE_DEFAULT, gradient_delay=GRADIENT_DELAY, phase_mode=False):
     ''' Takes in the raw data, and returns the organised data points. This initially
-        gets the number of ticks and thus the alight-time of the data point. It then
-        also carefully checks if any of the data points overlap in time and thus need
-        to be merged.
+        gets the number of ticks and thus the alight-time of the data point.
         If in phase_mode, the energy tick rate required is set to enforce a constant
         number of ticks regardless the energy of the data point. '''
 
-    data_raw['energy_tick_rate'] = get_rate(data_raw['energy'], num_ticks=PHASE_MODE_TICKS) if phase_mode else energy_tick_rate  # Number of ticks held constant if in phase_mode.
-    data_raw['num_ticks'] = get_num_ticks(data_raw['energy'], energy_tick_rate)  # *** Number of ticks this pixel has is based on the energy. ***
-    data_raw['alight_time'] = get_quantity(data_raw['num_ticks'], gradient_delay)  # How long should this pixel be lit up for?
+    # The derived columns are kept as small as the raw ones, they're added to every row.
+    data_raw['energy_tick_rate'] = (get_rate(data_raw['energy'], num_ticks=PHASE_MODE_TICKS) if phase_mode else energy_tick_rate)  # Number of ticks held constant if in phase_mode.
+    data_raw['energy_tick_rate'] = data_raw['energy_tick_rate'].astype('float32')
+    data_raw['num_ticks'] = ceil(data_raw['energy'] / data_raw['energy_tick_rate']).astype('int32')  # *** Number of ticks this pixel has is based on the energy. ***
+    data_raw['alight_time'] = (data_raw['num_ticks'] * gradient_delay).astype('float32')  # How long should this pixel be lit up for?
 
 # initalise values for start and end times
     start_time = data_raw['time'].tolist()
@@ -565,59 +697,131 @@ def get_energy_tick_data(data_raw, energy_tick_rate=ENERGY_TICK_RATE_DEFAULT, gr
 
     else:
 
-        # We need to make sure that any hits on pixels that are already lit up do not overwrite, but instead add, energy to the pixel.
-        for n, dA in tqdm(enumerate(data_processed), desc="Processing tick data"):  # d for data point.
+        # Hits on pixels that are already lit up are not merged here. Outside of phase mode the tick data is
+        # handled by get_energy_decay_events, which adds the energy of a hit to what a pixel has left.
+        data_raw['start_time'] = start_time
+        data_raw['end_time'] = end_time
+
+    return data_raw
 
-            for nB, row_i in enumerate(data_raw.iterrows()):
-                # Only bother look at data points ahead of the currently considered one.
-                if nB >= nA:
-                    continue
-                if (row_i['x'] == curr_x) & (row_i['y'] == curr_y) & (row_i['start_time'] < t):
 
-                    # An event, dB, occurs within the time frame that dA is still alight.
+def get_energy_accum_events(data, displays, color_gradient=COLOR_GRADIENT_DEFAULT):
+    ''' get_energy_accum_data should be used before this to obtain the data. '''
+    ''' This takes the accumulated data and creates the associated events based on the energy, given
+        the energy_method is accumulate. This is just one pixel update per data point, all worked out
+        on whole columns at once before being grouped into events. '''
 
-                    # Therefore, we erase the ticks of the initial iA event that would occur after iB has started.
-                    # This includes remove the final background colour tick of iA, which iB will now deal with.
-                    data_raw['num_ticks'].iat[nA] -= get_num_ticks(data_raw['end_time'].iat[nA]-data_raw['start_time'].iat[nB], gradient_delay)
+    times = data['time'].to_numpy(dtype=float)
+    x = data['x'].to_numpy(dtype=int)
+    y = data['y'].to_numpy(dtype=int)
+    side = data['side'].to_numpy(dtype=int)
 
-                    # The initial iA event end time is now equal to the latter iB event start time.
-                    data_raw['end_time'].iat[nA] = data_raw['start_time'].iat[nB]
+    colors = get_colors_from_gradient(data['energy'].to_numpy(dtype=float), color_gradient, len(data))
 
-                    # The energy of the latter iB event will be itself plus |the energy of the initial iA event minus the amount it has decayed by|.
-                    data_raw['energy'].iat[nB] += data_raw['energy'].iat[nA] - data_raw['num_ticks'].iat[nA] * energy_tick_rate
+    display_IDs, _ = get_display_IDs(displays, x, y, side)  # Mirror displays are sent their principal's frames, flipped, when uploading.
 
-                    # Now re-compute the (greater) number of ticks and the (later) end time for the latter iB event.
-                    data_raw['num_ticks'].iat[nB] = get_num_ticks(data_raw['energy'].iat[nB], energy_tick_rate)  # *** Number of ticks this pixel has is based on the energy. ***
-                    data_raw['end_time'].iat[nB] = data_raw['start_time'].iat[nB] + get_quantity(data_raw['num_ticks'].iat[nB], gradient_delay)  # Start time + alight time.
+    size = displays[0].size
 
-                    # # If dA overlaps with a dC, this will be dealt with by dB, so may as well break here to save time.
-                    break
-                else:
-                    continue
-                
-    return data_raw
+    # Add an extra update at the end so the display doesn't vanish immediately.
+    if len(times) > 0:
+        times = concatenate([times, times[-1:] + 1.0])  # 1 second later.
+        x, y, colors, display_IDs = (concatenate([a, a[-1:]]) for a in (x, y, colors, display_IDs))
 
+    # If this side or pixel don't map to a display, we ignore it.
+    main = display_IDs >= 0
 
-def get_energy_accum_events(data_points, displays, color_gradient=COLOR_GRADIENT_DEFAULT):
-    ''' get_energy_accum_data should be used before this to obtain the data_points. '''
-    ''' This takes a DataPoint and creates the associated events based on the energy,
-        given the energy_method is accumulate. This is just one event per data point. '''
+    # Turns global x and y into local. The data is already in time order.
+    return get_grouped_events(times[main], x[main] % size, y[main] % size, colors[main], display_IDs[main])
 
-    events = []
-    for data_point in data_points:
-        color = COLOR_DEFAULT if data_point.energy <= 0.0 else get_color_from_gradient(data_point.energy, color_gradient,len(data_points))
 
-        display_ID = get_display_ID(displays, data_point.x, data_point.y, data_point.side)
+def get_energy_decay_events(data, displays, color_gradient=COLOR_GRADIENT_DEFAULT,
+                            energy_tick_rate=ENERGY_TICK_RATE_DEFAULT, gradient_delay=GRADIENT_DELAY):
+    ''' Creates the events for the energy_method tick. Each pixel decays on its own clock from its latest hit, as in
+        get_energy_tick_events: it shows the colour of its energy at the time of the hit, then every `gradient_delay`
+        seconds after that its energy decays by `energy_tick_rate`, until it is blank. A hit on a pixel which is
+        still lit adds to the energy it has left, and restarts its clock. Only changes of colour are output, with
+        the updates at exactly the same time put together into one event.
+        Working out the energy each hit leaves a pixel with is one pass over the repeat hits, everything else is
+        done on whole arrays, so the cost grows with the number of colour changes rather than hits x ticks. '''
+
+    assert gradient_delay > 0.0, 'Gradient delay should be > 0.0.'
+    assert energy_tick_rate > 0.0, 'Energy tick rate should be > 0.0.'
+
+    x = data['x'].to_numpy(dtype=int)
+    y = data['y'].to_numpy(dtype=int)
+
+    display_IDs, _ = get_display_IDs(displays, x, y, data['side'].to_numpy(dtype=int))
+
+    # If this side or pixel don't map to a display, we ignore it.
+    keep = display_IDs >= 0
 
-        x = data_point.x % displays[display_ID].size  # Turns global x into local.
-        y = data_point.y % displays[display_ID].size  # Turns global y into local.
+    if not keep.any():
+        return []
 
-        events.append(Event([x], [y], [color], [display_ID], data_point.start_time))  # x, y, color, ID are lists.
+    size = displays[0].size
 
-    # Add an extra event at the end so the display doesn't vanish immediately.
-    if len(events) > 0:
-        e = events[-1]
-        events.append(Event(e.x_values, e.y_values, e.colors, e.display_IDs, e.start_time+1.0))  # 1 second later.
+    # Every pixel of every display gets its own number: display ID * size * size + x + size * y.
+    pixels = display_IDs[keep] * size * size + (x[keep] % size) + size * (y[keep] % size)
+    times = data['time'].to_numpy(dtype=float)[keep]
+    energies = data['energy'].to_numpy(dtype=float)[keep]
+
+    # Put the hits on each pixel together, in time order.
+    order = lexsort((times, pixels))
+    pixels, times, energies = pixels[order], times[order], energies[order]
+
+    first_hit = concatenate([[True], pixels[1:] != pixels[:-1]])  # The first hit on its pixel?
+    last_hit = concatenate([first_hit[1:], [True]])  # The last hit on its pixel?
+
+    # The energy each hit leaves its pixel with, which includes what the pixel had left from the hit before.
+    # The decay ticks which happened by the time of the next hit are counted in whole ticks of the earlier hit's
+    # clock (the tolerance is so a tick due at the same time as the next hit counts as done, despite rounding).
+    totals = energies.tolist()
+    time_values = times.tolist()
+
+    for n in where(~first_hit)[0].tolist():
+        ticks = math.floor((time_values[n] - time_values[n-1]) / gradient_delay + 1e-9)
+        totals[n] += max(totals[n-1] - ticks * energy_tick_rate, 0.0)
+
+    totals = array(totals)
+
+    # How many updates each hit makes: one for the hit and then one for each tick, until the pixel is blank or hit again.
+    counts = ceil(totals / energy_tick_rate).astype(int) + 1
+
+    next_times = concatenate([times[1:], times[-1:]])
+    until_next = ceil((next_times - times) / gradient_delay - 1e-9).astype(int)  # Ticks due before the next hit.
+    counts = where(last_hit, counts, minimum(counts, until_next))
+
+    # Expand every hit into its updates.
+    hit_indices = repeat(arange(len(times)), counts)
+    ticks = arange(len(hit_indices)) - repeat(cumsum(counts) - counts, counts)
+
+    update_pixels = pixels[hit_indices]
+    update_times = times[hit_indices] + ticks * gradient_delay
+    colors = get_colors_from_gradient(maximum(totals[hit_indices] - ticks * energy_tick_rate, 0.0), color_gradient, len(data))
+
+    # The updates are still in order for each pixel, so only keep those which change its colour (every pixel starts blank).
+    previous = concatenate([[COLOR_DEFAULT], colors[:-1]])
+    previous[concatenate([[True], update_pixels[1:] != update_pixels[:-1]])] = COLOR_DEFAULT
+
+    changed = colors != previous
+
+    # Then put them in time order, and make an event of the updates at each time.
+    order = argsort(update_times[changed], kind='stable')
+
+    update_times = update_times[changed][order]
+    update_pixels = update_pixels[changed][order]
+    colors = colors[changed][order]
+
+    boundaries = where(diff(update_times) != 0.0)[0] + 1
+
+    events = []
+
+    for group_times, group_pixels, group_colors in zip(split(update_times, boundaries), split(update_pixels, boundaries),
+                                                        split(colors, boundaries)):
+        local_pixels = group_pixels % (size * size)
+
+        events.append(Event((local_pixels % size).tolist(), (local_pixels // size).tolist(), group_colors.tolist(),
+                            (group_pixels // (size * size)).tolist(), float(group_times[0])))
 
     return events
 
@@ -643,11 +847,11 @@ def get_energy_tick_events(data_points, displays, color_gradient=COLOR_GRADIENT_
             color = COLOR_DEFAULT if energy <= 0.0 else get_color_from_gradient(energy, color_gradient,len(data_points))
             #print("Colour is ",color)
 
-            display_ID, mirror_ID = get_display_ID(displays, data_point.x, data_point.y, data_point.side)
+            display_ID, _ = get_display_ID(displays, data_point.x, data_point.y, data_point.side)  # Mirror displays are sent their principal's frames, flipped, when uploading.
 
             #if (tick==0):
             #    print("Global coord data ",data_point.x, data_point.y, data_point.side)
-            #print("Displays are ",display_ID,mirror_ID)
+            #print("Displays are ",display_ID)
             # If this side or pixel don't map to a display, we ignore it
             if (display_ID>=0):
                 x = data_point.x % displays[display_ID].size  # Turns global x into local.
@@ -655,25 +859,90 @@ def get_energy_tick_events(data_points, displays, color_gradient=COLOR_GRADIENT_
                 #if (tick==0):
                 #    print("Pixel data ",x,y, " on ",display_ID)
                 events.append(Event([x], [y], [color], [display_ID], data_point.start_time+tick*data_point.gradient_delay))  # x, y, color, ID are lists.
-            if (mirror_ID>=0):
-                x = displays[mirror_ID].size - 1 - data_point.x % displays[mirror_ID].size  # Turns global x into local and *mirrors*
-                y = data_point.y % displays[mirror_ID].size  # Turns global y into local.
-                #if (tick==0):
-                #    print("Pixel data ",x,y, " on ",mirror_ID)
-                events.append(Event([x], [y], [color], [mirror_ID], data_point.start_time+tick*data_point.gradient_delay))  # x, y, color, ID are lists.
     return events
 
-def storeData(data, _file='example'):
-    ''' Function to store preprocessed event data in a file for displaying later'''
-    import pickle
-    print(f"Dumping processed data to file: {_file}" )
-    # Dump data to file
-    dbfile = open(_file, 'ab')
-    # source, destination
-    pickle.dump(data, dbfile)                    
-    dbfile.close()
-    print('Done')
-    return
+def read_data_file(file_):
+    ''' Reads a data file into a dataframe with the columns and compact types of DATA_COLUMNS and DATA_DTYPES.
+        Parquet (.parquet, .pq) and Arrow IPC/Feather (.arrow, .feather, .ipc) files need pyarrow, anything
+        else is read as CSV. The columns are taken in order, whatever they are called in the file. '''
+
+    extension = file_.lower().rsplit('.', 1)[-1]
+
+    if extension in ('parquet', 'pq'):
+        return read_parquet_data(file_)
+
+    if extension in ('arrow', 'feather', 'ipc'):
+        return read_arrow_data(file_)
+
+    # Check the header first, so the columns can be named and typed as they are parsed.
+    header = pd.read_csv(file_, sep=',', nrows=0)
+
+    assert len(header.columns) == 6, 'Number of columns of data should be 6.'
+
+    # Straight into compact types rather than the default 64 bit ones. BT: give the datframe columns some sensible lables
+    return pd.read_csv(file_, sep=',', header=0, names=DATA_COLUMNS, dtype=DATA_DTYPES)
+
+
+def get_arrow_schema():
+    ''' The Arrow schema data files are converted to, matching DATA_DTYPES. '''
+
+    import pyarrow as pa
+
+    return pa.schema([(name, pa.from_numpy_dtype(DATA_DTYPES[name])) for name in DATA_COLUMNS])
+
+
+def get_arrow_dataframe(batches, names):
+    ''' Renames and casts a stream of record batches with the data columns, and converts them to a dataframe.
+        Each batch is cast as it arrives, so only the compact copy of the whole file is ever held. '''
+
+    import pyarrow as pa
+
+    assert len(names) == 6, 'Number of columns of data should be 6.'
+
+    schema = get_arrow_schema()
+
+    table = pa.Table.from_batches([pa.RecordBatch.from_arrays([batch.column(name).cast(field.type) for name, field in zip(names, schema)], schema=schema)
+                                   for batch in batches], schema=schema)
+
+    # The columns have no nulls, so each can become its own numpy block without another copy.
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_parquet_data(file_):
+    ''' Reads a Parquet data file one row group at a time, reading only the six data columns. '''
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f'Reading {file_} needs pyarrow, install it or convert the file to CSV.')
+
+    parquet_file = pq.ParquetFile(file_, memory_map=True)
+
+    names = parquet_file.schema_arrow.names[:6]
+
+    return get_arrow_dataframe(parquet_file.iter_batches(columns=names), names)
+
+
+def read_arrow_data(file_):
+    ''' Reads an Arrow IPC or Feather (v2) data file. The file is memory mapped, so uncompressed columns which
+        already have the right type are used without being copied. '''
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError(f'Reading {file_} needs pyarrow, install it or convert the file to CSV.')
+
+    with pa.memory_map(file_, 'r') as source:
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(n) for n in range(reader.num_record_batches))
+        except pa.ArrowInvalid:  # Written as a stream rather than a file.
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = iter(reader)
+
+        return get_arrow_dataframe(batches, reader.schema.names[:6])
+
 
 def check_file(out_file):
     '''Function to check if file is valid and if it exists to avoid overwriting.'''
@@ -692,29 +961,13 @@ def check_file(out_file):
         print(f'Deleting previous file: {out_file}')
         path.unlink()
 
-def loadData(_file='example'):
-    ''' Function to load preprocessed event data from file for displaying.'''
-    import pickle
-    print(f"Loading processed data from file: {_file}" )
-    dbfile = open(_file, 'rb')    
-    data = pickle.load(dbfile)
-    dbfile.close()
-    print('Done')
-    return data
-
 class DataPoint:
+    # Slotted as there can be millions of these. They don't check their own values, that is done for a
+    # whole stage at once by validate_data_points if validation is switched on.
+    __slots__ = ('x', 'y', 'side', 'energy', 'energy_tick_rate', 'ticks', 'gradient_delay', 'start_time', 'end_time')
+
     def __init__(self, x, y, side=0, energy=0.0, energy_tick_rate=ENERGY_TICK_RATE_DEFAULT,
                  ticks=0, gradient_delay=GRADIENT_DELAY, start_time=0.0, end_time=inf):
-        assert isinstance(x, int)
-        assert isinstance(y, int)
-        assert isinstance(side, int)
-        assert isinstance(energy, (float, int))
-        assert isinstance(energy_tick_rate, (float, int))
-        assert isinstance(ticks, int)
-        assert isinstance(gradient_delay, (float, int))
-        assert isinstance(start_time, (float, int))
-        assert isinstance(end_time, (float, int))
-
         self.x = x  # This is the global x co-ordinate.
         self.y = y  # This is the global y co-ordinate.
         self.side = side
@@ -730,34 +983,3 @@ class DataPoint:
 
     def __repr__(self):
         return f'({self.x},{self.y})  {self.energy:6.2f}  {self.start_time:6.2f}'
-
-
-class Event:
-    def __init__(self, x_values, y_values, colors, display_IDs, start_time=0.0):
-        assert all(isinstance(x, int) for x in x_values)
-        assert all(isinstance(y, int) for y in y_values)
-        assert all(isinstance(color, int) for color in colors)
-        assert all(isinstance(ID, int) for ID in display_IDs)
-        assert all(255 >= color >= 0 for color in colors)
-        assert isinstance(start_time, (float, int))
-
-        self.x_values = x_values  # These are the local x co-ordinates.
-        self.y_values = y_values  # These are the local y co-ordinates.
-        self.colors = colors
-        self.display_IDs = display_IDs
-        self.start_time = start_time
-
-    def __iter__(self):
-        return iter(zip(self.x_values, self.y_values, self.colors, self.display_IDs))
-
-    def __lt__(self, other):
-        return self.start_time < other.start_time
-
-    def __repr__(self):
-        s = ''
-
-        for x, y, color, display_ID in self:
-            s += f'({x},{y})  {color}  {self.start_time:6.2f}\n'
-
-        return s[:-1]
-
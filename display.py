@@ -1,14 +1,16 @@
 from copy import deepcopy
-from numpy import ceil, sqrt
+from math import ceil, sqrt
 from smbus import SMBus
-from time import sleep
+from time import sleep, time
 
 from parameters import DEFAULT_I2C_ADDR, I2C_CMD_DISP_OFF, I2C_CMD_GET_DEV_ID, I2C_CMD_SET_ADDR, \
     I2C_CMD_DISP_EMOJI, I2C_CMD_DISP_NUM, I2C_CMD_DISP_STR, I2C_CMD_DISP_CUSTOM, I2C_CMD_CONTINUE_DATA, \
     I2C_MULTIPLEXER_ID, I2C_MULTIPLEXER_CHANNEL_IDs, \
     DEVICE_NUM_MIN, DEVICE_NUM_MAX, CHANNEL_NUM_MIN, CHANNEL_NUM_MAX, LETTERS, \
-    COLORS, COLOR_DEFAULT, WAIT_READ, WAIT_WRITE, I2C_CMD_DISP_ROTATE,I2C_CMD_DISP_OFFSET
+    COLORS, COLOR_DEFAULT, WAIT_READ, WAIT_WRITE, I2C_CMD_DISP_ROTATE,I2C_CMD_DISP_OFFSET, \
+    UPLOAD_STALENESS_MAX, UPLOAD_PIXEL_WEIGHT, ANIMATION_FRAMES_MAX
 
+from profiling import stage
 from utility import int_to_bytes
 
 
@@ -77,18 +79,73 @@ def get_displays(bus, layout=None, mirror=False):
             current_ID += 1
 
         # Now give IDs to any displays which are "mirroring" a principal display. When mirroring, the mirror display should
-        # have the same display coordinates (the actual mirroring is done at setup for the addresses, and when plotting)
+        # have the same display coordinates (the actual mirroring is done at setup for the addresses, and when uploading)
         if mirror:
              for Y, X in YXs:  # divmod() gives (Y, X) co-ordinates so need to be careful.
                 displays.append(Display(side=side, X=X, Y=Y, ID=current_ID, address=addresses[current_ID], channel=channels[current_ID], mirror=True))
                 current_ID += 1
-            
+
+    link_mirror_displays(displays)
+
+    return displays
+
+
+def get_sim_displays(layout=None, mirror=False):
+    ''' Returns displays for the given layout without scanning a bus, e.g. for simulating or pre-processing.
+        The displays are numbered in the same way as get_displays. '''
+
+    assert isinstance(mirror, bool)
+
+    if layout is not None:
+        if isinstance(layout, int):
+            layout = (layout,)  # If a single number is supplied, turn it into a tuple.
+        else:
+            assert isinstance(layout, tuple)
+            assert all(isinstance(i, int) for i in layout)
+
+    addresses = [DEFAULT_I2C_ADDR]
+
+    # If a layout was supplied, ensure we have at least enough devices.
+    if layout is not None:
+        num_displays = 2*sum(layout) if mirror else sum(layout)
+
+        if len(addresses) < num_displays:
+            addresses *= 1 + num_displays // len(addresses)  # Duplicate addresses until we have enough.
+
+        # We only keep the addresses that are needed if a layout is supplied.
+        addresses = addresses[:num_displays]
+
+    else:  # Just create a dummy layout if none was supplied.
+        layout = (len(addresses),)
+
+    # Let's now create the Display objects.
+    displays = []
+
+    # The side, X and Y data for each display.
+    coordinates = [[divmod(n, int(ceil(sqrt(side_size)))) for n in range(side_size)] for side_size in layout]
+
+    current_ID = 0
+
+    for (side, YXs) in enumerate(coordinates):
+        for Y, X in YXs:  # divmod() gives (Y, X) co-ordinates so need to be careful.
+            displays.append(Display(side=side, X=X, Y=Y, ID=current_ID, address=addresses[current_ID]))
+            current_ID += 1
+
+        if mirror:
+            for Y, X in YXs:
+                displays.append(Display(side=side, X=X, Y=Y, ID=current_ID, address=addresses[current_ID], mirror=True))
+                current_ID += 1
+
+    link_mirror_displays(displays)
+
     return displays
 
 
 def get_addresses(bus):
     assert isinstance(bus, SMBus)
 
+    profile = stage('get_addresses').start()
+
     addresses = []
     channels = []
 
@@ -115,6 +172,8 @@ def get_addresses(bus):
                 addresses.append(device)
                 channels.append(channel)
 
+    profile.stop(items=len(addresses))
+
     return addresses, channels
 
 
@@ -207,7 +266,37 @@ def clear_displays(bus, displays):
     assert isinstance(bus, SMBus)
 
     for display in displays:
-        display.clear_display(bus)
+        try:
+            display.clear_display(bus)
+        except OSError as error:  # Carry on clearing the others.
+            print(f'Warning: could not clear display {display.ID}: {error}')
+
+
+def get_next_display(displays, current_channel=None, now=None, max_staleness=UPLOAD_STALENESS_MAX):
+    ''' Returns the display whose pending frame should be uploaded next, or None if nothing is pending.
+        Any display that has waited longer than max_staleness is served first, oldest first. Otherwise
+        displays on the currently active channel are preferred, as switching channel costs a bus write,
+        and then the most urgent, i.e. the one which has waited longest with the most pixels changed.
+        Displays whose device is failing are left out until they are due to be tried again. '''
+
+    now = time() if now is None else now
+
+    def priority(display):
+        waited = now - display.pending_since
+
+        urgency = waited + display.pending_changes * UPLOAD_PIXEL_WEIGHT
+
+        stale = waited >= max_staleness
+
+        # Stale displays go by age alone, whatever their channel.
+        return (not stale, -waited if stale else 0.0, display.channel != current_channel, -urgency)
+
+    pending = [display for display in displays if display.needs_updating and display.retry_after <= now]
+
+    if len(pending) == 0:
+        return None
+
+    return min(pending, key=priority)
 
 
 def get_display_ID(displays, x, y, side):
@@ -239,6 +328,76 @@ def get_display_ID(displays, x, y, side):
     raise ValueError(f'Could not find display to show pixel ({x}, {y}) on side {side}.')
 
 
+def get_display_IDs(displays, x, y, side):
+    ''' Array version of get_display_ID. Takes arrays of global (x, y) co-ordinates and sides and returns
+        two arrays holding the main and mirror display IDs for each of them, or -1 where there is none. '''
+
+    from numpy import full  # Only needed when pre-processing, so kept off the playback import path.
+
+    assert len(displays) > 0, 'No displays found.'
+    assert len({d.size for d in displays}) == 1, 'Can currently only work with all displays of equal size.'
+
+    display_size = displays[0].size  # We are assuming they are all the same size.
+
+    num_sides = max(display.side for display in displays) + 1
+    len_X = max(display.X for display in displays) + 1
+    len_Y = max(display.Y for display in displays) + 1
+
+    # Lookup tables from (side, Y, X) display co-ordinates to display IDs.
+    main_map = full((num_sides, len_Y, len_X), -1, dtype=int)
+    mirror_map = full((num_sides, len_Y, len_X), -1, dtype=int)
+
+    for display in displays:
+        if display.mirror:
+            mirror_map[display.side, display.Y, display.X] = display.ID
+        else:
+            main_map[display.side, display.Y, display.X] = display.ID
+
+    X = x // display_size
+    Y = y // display_size
+
+    # Co-ordinates which fall outside the layout don't map to a display.
+    inside = (side >= 0) & (side < num_sides) & (X >= 0) & (X < len_X) & (Y >= 0) & (Y < len_Y)
+
+    main_IDs = full(X.shape, -1, dtype=int)
+    mirror_IDs = full(X.shape, -1, dtype=int)
+
+    main_IDs[inside] = main_map[side[inside], Y[inside], X[inside]]
+    mirror_IDs[inside] = mirror_map[side[inside], Y[inside], X[inside]]
+
+    return main_IDs, mirror_IDs
+
+
+def get_mirror_IDs(displays):
+    ''' Returns a list, indexed by display ID, of the ID of the display mirroring each display, or -1 if it has none. '''
+
+    mirror_IDs = [-1] * (max(display.ID for display in displays) + 1)
+
+    principal_IDs = {(display.side, display.X, display.Y): display.ID for display in displays if not display.mirror}
+
+    for display in displays:
+        if display.mirror:
+            mirror_IDs[principal_IDs[(display.side, display.X, display.Y)]] = display.ID
+
+    return mirror_IDs
+
+
+def link_mirror_displays(displays):
+    ''' Tells each principal display which displays mirror it. The timeline only has events for the principal
+        displays, every frame they queue is also queued for their mirrors, which flip it when it is uploaded. '''
+
+    mirror_IDs = get_mirror_IDs(displays)
+
+    for display in displays:
+        display.mirrors = [] if display.mirror or mirror_IDs[display.ID] < 0 else [displays[mirror_IDs[display.ID]]]
+
+
+def get_mirrored_frame(frame, size):
+    ''' Flips a frame horizontally, i.e. reverses each row of pixels (x + size * y -> size - 1 - x + size * y). '''
+
+    return [color for y in range(size) for color in reversed(frame[size * y:size * (y + 1)])]
+
+
 class Display:
     def __init__(self, size=8, side=0, X=0, Y=0,
                  ID=0, address=DEFAULT_I2C_ADDR, channel=I2C_MULTIPLEXER_ID, mirror=False):
@@ -274,11 +433,39 @@ class Display:
 
         self.display_frame_A = True  # Do we use the A or B frame for displaying?
         self.change_detected = False  # Has a change been detected on this display from the data manager?
-        self.needs_updating = False  # So the display thread knows whether to bother updating this display or not.
+        self.buffer_changes = 0  # How many pixel changes have been made to the buffer frame since it was last queued?
+
+        # The hand over of frames between the data and display threads doesn't need a lock. The data thread publishes
+        # each frame as a new (sequence, frame, animation, since, changes, mirrored) tuple, replacing the last with a single
+        # assignment, so the display thread always sees a whole one. The display thread only records which sequence
+        # number it took last. Each side only ever writes its own fields.
+        self.published = (0, None, None, 0.0, 0, False)  # Latest frame handed over, see hand_over_frame. Written by the data thread.
+        self.taken = 0  # Sequence number of the last frame taken for upload. Written by the display thread...
+        self.taken_before = 0  # ... as is the one taken before that, in case the upload fails and it is put back.
+        self.worst_wait = 0.0  # Longest time a queued frame has waited before being taken for upload.
+        self.frames_dropped = 0  # How many queued frames were replaced by a newer one before they could be uploaded?
+        self.frame_sink = None  # If set, frames are handed to this instead, e.g. FrameRing.write to send them to a bus process.
+        self.mirrors = []  # Displays which show this display's frames flipped, see link_mirror_displays.
+        self.retry_after = 0.0  # If the last upload failed, when is it worth trying this display again?
 
     def __repr__(self):
         return f'{self.addr}: ({self.X},{self.Y}) side {self.side}'
 
+    @property
+    def needs_updating(self):
+        ''' So the display thread knows whether to bother updating this display or not. '''
+        return self.published[0] != self.taken
+
+    @property
+    def pending_since(self):
+        ''' When was the oldest frame not yet uploaded queued, i.e. the upload deadline? '''
+        return self.published[3]
+
+    @property
+    def pending_changes(self):
+        ''' How many pixel changes are waiting to be uploaded? '''
+        return self.published[4]
+
     def get_VID(self, bus):
         assert isinstance(bus, SMBus)
     
@@ -424,7 +611,7 @@ class Display:
         bus.write_i2c_block_data(self.addr, I2C_CMD_CONTINUE_DATA, frame[32:])  # TODO: remove assumption that we have 8x8.
         sleep(WAIT_WRITE)
 
-    def display_current_frame(self, bus, duration=1, forever=False, update_channel=True):
+    def display_current_frame(self, bus, duration=1, forever=False, update_channel=True, frame=None):
         assert isinstance(bus, SMBus)
         assert isinstance(duration, (float, int))
         assert isinstance(forever, bool)
@@ -438,7 +625,10 @@ class Display:
         # The latter 3 zeroes are redundant data.
         data = [duration_bytes[1], duration_bytes[0], forever, 1, 0, 0, 0]  # The 1 is the number of frames.
 
-        frame = self.frame_A if self.display_frame_A else self.frame_B
+        if frame is None:
+            frame = self.frame_A if self.display_frame_A else self.frame_B
+
+        assert len(frame) == self.size * self.size
 
         if update_channel:
             activate_channel(bus, self.channel)
@@ -452,6 +642,37 @@ class Display:
         bus.write_i2c_block_data(self.addr, I2C_CMD_CONTINUE_DATA, frame[32:])  # TODO: remove assumption that we have 8x8.
         sleep(WAIT_WRITE)
 
+    def display_frames(self, bus, frames, duration=1, forever=False, update_channel=True):
+        ''' Uploads several frames at once, which the matrix then plays itself, showing each for `duration` seconds. '''
+
+        assert isinstance(bus, SMBus)
+        assert isinstance(duration, (float, int))
+        assert isinstance(forever, bool)
+        assert isinstance(update_channel, bool)
+
+        assert ANIMATION_FRAMES_MAX >= len(frames) > 0, f'Can only upload between 1 and {ANIMATION_FRAMES_MAX} frames.'
+        assert all(len(frame) == self.size * self.size for frame in frames)
+        assert duration > 0.001, 'Error: duration should be at least 1 ms.'
+
+        duration_bytes = int_to_bytes(int(duration * 1000)) # Duration is in ms.
+
+        if update_channel:
+            activate_channel(bus, self.channel)
+
+        # Each frame is sent with the same header as in display_current_frame, but with the total number of frames
+        # and the index of this frame. The frames are sent last to first, the same order as displayFrames in the
+        # matrix's Arduino library (Grove_Two_RGB_LED_Matrix): the firmware starts playing as soon as frame 0 arrives,
+        # so sending it last means every other frame is already in place by then.
+        for index in reversed(range(len(frames))):
+            data = [duration_bytes[1], duration_bytes[0], forever, len(frames), index, 0, 0]
+
+            bus.write_i2c_block_data(self.addr, I2C_CMD_DISP_CUSTOM, data)
+            sleep(WAIT_WRITE)
+            bus.write_i2c_block_data(self.addr, I2C_CMD_CONTINUE_DATA, frames[index][:32])  # TODO: remove assumption that we have 8x8.
+            sleep(WAIT_WRITE)
+            bus.write_i2c_block_data(self.addr, I2C_CMD_CONTINUE_DATA, frames[index][32:])  # TODO: remove assumption that we have 8x8.
+            sleep(WAIT_WRITE)
+
     def set_buffer_pixel(self, x, y, color):
         ''' Updates whichever frame is not in use for displaying with a provided pixel co-ordinate and colour. '''
 
@@ -465,20 +686,113 @@ class Display:
         assert self.size > y >= 0, 'Error: y value supplied is outside of frame range.'
         assert 255 >= color >= 0, 'Colour number should be between 0 and 255.'
 
-        if self.display_frame_A:                                         
-            self.frame_B[x + self.size * y] = color
-        else:
-            self.frame_A[x + self.size * y] = color
+        frame = self.frame_B if self.display_frame_A else self.frame_A
+        index = x + self.size * y
+
+        if frame[index] != color:
+            self.buffer_changes += 1
+
+        frame[index] = color
+
+    def set_buffer_frame(self, frame):
+        ''' Replaces the whole of the frame not in use for displaying, e.g. when playback jumps to a new time. '''
+
+        assert len(frame) == self.size * self.size
+
+        buffer = self.frame_B if self.display_frame_A else self.frame_A
+
+        self.buffer_changes += sum(old != new for old, new in zip(buffer, frame))
+
+        buffer[:] = frame
 
     def copy_buffer(self):
         if self.display_frame_A:
-            self.frame_B = deepcopy(self.frame_A)
+            self.frame_B[:] = self.frame_A
         else:
-            self.frame_A = deepcopy(self.frame_B)
+            self.frame_A[:] = self.frame_B
+
+    def discard_buffer(self):
+        ''' Throws away any changes made to the buffer since the last frame was queued. '''
+
+        self.copy_buffer()
+
+        self.buffer_changes = 0
 
     def switch_buffer(self):
         self.display_frame_A = not self.display_frame_A
 
+    def queue_frame(self, animation=None):
+        ''' Switches the buffers and hands a copy of the new frame to the display thread. Only the latest
+            frame is kept: if the previous one has not been uploaded yet it is replaced and counted as dropped.
+            An animation of (frames, duration) can be given for the matrix to play from this frame onwards. '''
+
+        self.switch_buffer()
+
+        frame = list(self.frame_A if self.display_frame_A else self.frame_B)
+
+        if self.frame_sink is not None:
+            self.frame_sink(self.ID, frame, animation, self.buffer_changes, time())  # The mirrors are dealt with wherever it ends up.
+        else:
+            # Any mirrors are handed the same frame, it is only flipped if and when they upload it.
+            for display in [self] + self.mirrors:
+                display.hand_over_frame(frame, animation, self.buffer_changes, mirrored=display is not self)
+
+        self.buffer_changes = 0
+
+    def hand_over_frame(self, frame, animation, changes, queued=None, mirrored=False):
+        ''' Makes a frame the one waiting to be uploaded by the display thread. This never waits for the display thread.
+            queued is when the frame was queued, if not now. mirrored says the frame is this mirror display's
+            principal's, so is to be flipped when uploaded. '''
+
+        sequence, _, _, since, pending_changes, _ = self.published
+
+        # If the last frame has been taken, this one starts a new wait. Otherwise it replaces it, and so inherits its
+        # deadline and changes. If the display thread takes the last frame just now, this only makes the wait look longer.
+        if sequence == self.taken:
+            since, pending_changes = time() if queued is None else queued, 0
+
+        self.published = (sequence + 1, frame, animation, since, pending_changes + changes, mirrored)
+
+    def skip_frame(self):
+        ''' Switches the buffers without handing the frame to the display thread, as the matrix is already
+            showing it as part of an animation. '''
+
+        self.switch_buffer()
+
+        self.buffer_changes = 0
+
+    def take_pending_frame(self):
+        ''' Returns the latest queued frame and animation (either can be None) and marks the display as up to date. '''
+
+        sequence, frame, animation, since, _, mirrored = self.published  # Read once, so the frame and its details all match.
+
+        if sequence == self.taken:
+            return None, None
+
+        self.frames_dropped += sequence - self.taken - 1  # Frames queued since the last one taken, but never taken.
+        self.worst_wait = max(self.worst_wait, time() - since)
+
+        self.taken_before = self.taken
+        self.taken = sequence
+
+        # Mirror displays are handed their principal's frames, so flip them now they're actually being sent. Timelines
+        # stored before that have their own events for the mirror displays, already flipped, which are sent as they are.
+        if mirrored and frame is not None:
+            frame = get_mirrored_frame(frame, self.size)
+
+            if animation is not None:
+                frames, duration = animation
+                animation = ([get_mirrored_frame(f, self.size) for f in frames], duration)
+
+        return frame, animation
+
+    def return_pending_frame(self):
+        ''' Puts back the frame from the last take_pending_frame, as it could not be uploaded. It is taken again next
+            time, unless a newer one has been queued since, and is still as late as it was. '''
+
+        self.frames_dropped -= self.taken - self.taken_before - 1
+        self.taken = self.taken_before
+
 
 def set_global_orientation(bus, displays, orientation=1):
     assert isinstance(bus, SMBus)
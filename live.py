@@ -0,0 +1,96 @@
+from multiprocessing.shared_memory import SharedMemory
+from struct import calcsize, pack_into, unpack_from
+
+from parameters import COLOR_DEFAULT, LIVE_FRAMES_NAME
+
+# The segment starts with a generation counter, the number of displays and their size, then holds the frame of every
+# display one after the other (indexed x + size * y, as in the frame buffer).
+HEADER = '<QHB5x'
+HEADER_SIZE = calcsize(HEADER)
+
+# Example, to watch what the displays are showing while playing on the hardware:
+#   run(data_file='Processed_data/example1', live=True)
+# and from another terminal (with the layout in plot_displays.py matching the one being played):
+#   python plot_displays.py --live
+
+
+class LiveFrames:
+    ''' The frame every display was last sent, in shared memory, so other processes (e.g. a viewer) can watch the
+        displays without adding any work to the upload path beyond copying each frame once.
+        There is one writer. The generation counter works as a seqlock: it is odd while a frame is being written and
+        goes up by two for every frame, so a reader knows both whether what it read was torn and whether anything
+        has changed since it last looked. '''
+
+    def __init__(self, memory, num_displays, size, owner):
+        self.memory = memory
+        self.num_displays = num_displays
+        self.size = size
+        self.frame_size = size * size
+        self.owner = owner  # Did we create the segment, and so should remove it?
+
+    @classmethod
+    def create(cls, num_displays, size=8, name=LIVE_FRAMES_NAME):
+        try:  # Left behind by a run which didn't finish cleanly.
+            SharedMemory(name=name).unlink()
+        except FileNotFoundError:
+            pass
+
+        memory = SharedMemory(name=name, create=True, size=HEADER_SIZE + num_displays * size * size)
+
+        pack_into(HEADER, memory.buf, 0, 0, num_displays, size)
+        memory.buf[HEADER_SIZE:] = bytes([COLOR_DEFAULT]) * (num_displays * size * size)
+
+        return cls(memory, num_displays, size, owner=True)
+
+    @classmethod
+    def attach(cls, name=LIVE_FRAMES_NAME):
+        try:
+            memory = SharedMemory(name=name, track=False)
+        except TypeError:  # Before Python 3.13, attaching registers the segment to be removed when this process exits.
+            from multiprocessing import resource_tracker
+
+            memory = SharedMemory(name=name)
+            resource_tracker.unregister(memory._name, 'shared_memory')
+
+        _, num_displays, size = unpack_from(HEADER, memory.buf, 0)
+
+        return cls(memory, num_displays, size, owner=False)
+
+    @property
+    def generation(self):
+        return unpack_from('<Q', self.memory.buf, 0)[0]
+
+    def publish(self, ID, frame):
+        ''' Records the frame display ID has just been sent. Only one thread or process should publish. '''
+
+        generation = self.generation
+
+        offset = HEADER_SIZE + ID * self.frame_size
+
+        pack_into('<Q', self.memory.buf, 0, generation + 1)  # Odd, being written.
+        self.memory.buf[offset:offset + self.frame_size] = bytes(frame)
+        pack_into('<Q', self.memory.buf, 0, generation + 2)  # Even, done.
+
+    def read(self, last_generation=None):
+        ''' Returns (generation, frames), with frames a bytes of every display's frame, one after the other. If
+            nothing has been published since last_generation, frames is None. Retries until it gets a consistent copy. '''
+
+        while True:
+            generation = self.generation
+
+            if generation == last_generation:
+                return generation, None
+
+            if generation % 2 == 1:  # The writer is part way through a frame.
+                continue
+
+            frames = bytes(self.memory.buf[HEADER_SIZE:])
+
+            if self.generation == generation:
+                return generation, frames
+
+    def close(self):
+        self.memory.close()
+
+        if self.owner:
+            self.memory.unlink()
@@ -1,16 +1,19 @@
-from smbus import SMBus
-from threading import Thread
+from threading import Event as ThreadEvent, Thread
 from time import sleep, time
 
-from data import Event, process_data
-from display import clear_displays, get_displays, activate_channel
+from bus import ResilientBus
+from display import clear_displays, get_displays, get_next_display, activate_channel, link_mirror_displays
 from parameters import FRAME_RATE, EVENT_TIME_DIFFERENCE_TOLERANCE, WAIT_DISPLAY, \
-                       MODE_DEFAULT, ENERGY_METHOD_DEFAULT, WAIT_WRITE
+                       MODE_DEFAULT, ENERGY_METHOD_DEFAULT, WAIT_WRITE, COLOR_DEFAULT
+from profiling import stage, enable_profiling, disable_profiling, print_report, save_chrome_trace
+from timeline import Event, Timeline, get_animations, storeData, loadData, load_timeline
 from utility import wait_for_matrix_ready
-from data import storeData, loadData
+
+# The pre-processing (data) module pulls in pandas, numpy and tqdm, which are slow to import on the Pi.
+# It is only imported when data actually needs pre-processing, so playing back a stored file doesn't pay for it.
 
 def get_bus():
-    return SMBus(1)
+    return ResilientBus(1)
 
 
 def reset():
@@ -18,11 +21,17 @@ def reset():
     global g_displays
     global g_break
     global g_current_channel
+    global g_live
+    global g_position
+    global g_stop
 
     g_bus = None  # The SMBus.
     g_displays = [] # List of displays.
     g_break = False  # Global break statement so each thread knows when to quit.
+    g_stop = ThreadEvent()  # Set by stop_playback, so the data manager stops straight away rather than when the next event is due.
     g_current_channel = None  # What channel of the multiplexer are we currently on?
+    g_live = None  # LiveFrames every uploaded frame is published to, if anything is watching.
+    g_position = (0, None)  # Index of the next event and the data time reached, so playback can carry on from there.
 
 
 def initialise(layout=None, bus=None, displays=None, force_displays=False, mirror=False):
@@ -42,114 +51,359 @@ def initialise(layout=None, bus=None, displays=None, force_displays=False, mirro
 
     assert len(g_displays) > 0, 'No displays found.'
 
+    link_mirror_displays(g_displays)  # In case the displays were made by hand, mirrors are only sent frames through their principal.
+
     clear_displays(g_bus, g_displays)
 
 
 
-def display_manager():
+def display_manager(until=None):
     global g_bus
     global g_displays
     global g_break
     global g_current_channel
 
+    # Normally the thread finishes with the playback (g_break). If given an Event as until, it carries on over any
+    # number of plays until that is set, as in the daemon.
+
     while True:
-        for display in g_displays:
-            if display.needs_updating:
+        # Read this before looking for work, so frames queued just before the data manager finished are still sent.
+        finished = g_break if until is None else until.is_set()
 
-                if (g_current_channel is None) or (g_current_channel != display.channel):
-                    activate_channel(g_bus, display.channel)
-                    g_current_channel = display.channel
+        # Pick the next display to serve. This is re-evaluated after every upload, so a display which
+        # has been waiting too long is never stuck behind a fixed ordering of the others.
+        display = get_next_display(g_displays, g_current_channel)
 
-                display.display_current_frame(g_bus, forever=True, update_channel=False)  # forever=True as timing is handled by the data manager. update_channel=False as is handled by display_manager (just above).
+        if display is None:
+            if finished:
+                clear_displays(g_bus, g_displays)
+                break
 
-                display.needs_updating = False
+            sleep(WAIT_DISPLAY)
 
-        sleep(WAIT_DISPLAY)
+            continue
 
-        if g_break:
-            clear_displays(g_bus, g_displays)
-            break
+        # Take the latest queued frame. Any frames queued while we were busy with other displays
+        # have already been coalesced into this one by the data manager.
+        frame, animation = display.take_pending_frame()
+
+        if frame is None:
+            continue
 
+        profile = stage('upload', items=1 if animation is None else len(animation[0])).start()
+
+        try:
+            if (g_current_channel is None) or (g_current_channel != display.channel):
+                activate_channel(g_bus, display.channel)
+                g_current_channel = display.channel
 
-def data_manager(data):
+            if animation is None:
+                display.display_current_frame(g_bus, forever=True, update_channel=False, frame=frame)  # forever=True as timing is handled by the data manager. update_channel=False as is handled by display_manager (just above).
+            else:
+                frames, duration = animation
+                display.display_frames(g_bus, frames, duration, forever=True, update_channel=False)  # The matrix plays these itself, the data manager sends the next frame as the animation ends. forever=True so that, if that's late, the matrix carries on rather than going blank.
+
+            profile.stop()
+
+            if g_live is not None:
+                g_live.publish(display.ID, frame)
+        except OSError as error:
+            # The bus has already retried. Put the frame back and leave this display alone until its device is worth
+            # trying again, the other displays carry on as normal.
+            display.return_pending_frame()
+            display.retry_after = getattr(error, 'retry_after', time())
+            g_current_channel = None  # Not sure what state the multiplexer is in now.
+
+
+def data_manager(data, animations=None, speed=1.0, start=0, start_time=None, loops=1):
     global g_bus
     global g_displays
     global g_break
+    global g_position
 
     assert isinstance(data, (list, tuple))
     assert all(isinstance(d, Event) for d in data)
+    assert isinstance(speed, (float, int))
+    assert speed > 0.0, 'Speed should be > 0.0.'  # How many seconds of data time are played per second, e.g. 0.25 or 20.
+    assert isinstance(start, int)
+    assert 0 <= start <= len(data)  # Index of the first event to play, e.g. from Timeline.seek.
+    assert isinstance(loops, int)
+    assert loops >= 0, 'Loops should be >= 0.'  # How many times to play the data, 0 for forever (until g_break is set).
 
-    time_last_error_msg = -999.0
-    previous_start_time = 0.0
+    # If given, the animations and covered updates from get_animations for uploading fades in one go.
+    animations, covered = ({}, set()) if animations is None else animations
 
-    first_pass = True
-    no_new_data = False
+    animating = set()  # IDs of the displays whose matrix is currently playing an animation we queued.
 
-    while True:
-        start_time = time()
+    time_last_error_msg = -999.0
 
-        # Get the next event.
-        try:
-            event = data.pop(0)
-            #print(event)
-        except IndexError:
-            no_new_data = True
+    # Wall clock time corresponding to a data time of 0. If playback starts from a given time, that time is now,
+    # otherwise the first event is shown straight away.
+    time_zero = None if start_time is None else time() - start_time / speed
 
-        if no_new_data:
-            g_break = True
+    n = start  # Index of the next event. The data is left as it is, so it can be played again.
+    loop = 0
 
+    while n < len(data):
         if g_break:
             break
 
-        # First, go and get all the IDs of the displays that are to be updated.
-        updated_display_IDs = set(event.display_IDs)
-        #print("Updated display IDs ",updated_display_IDs)
-        
-        # Then, use the set here so we only copy the buffers once.
-        for ID in updated_display_IDs:
-            #print("ID ",ID,g_displays[ID].ID,g_displays[ID].addr)
-            g_displays[ID].copy_buffer()
-        sleep(0.1) # without this, the copy doesn't always complete in time
+        event = data[n]
 
-        # Finally, actually do the pixel updates.
-        for x, y, color, ID in event:
-            #print("x,y,color,ID ",x,y,color,ID)
-            g_displays[ID].set_buffer_pixel(x, y, color)
+        # Events are scheduled against a fixed anchor rather than relative to the previous event, so any
+        # time lost while running behind is not carried forward into every later event.
+        first_pass = time_zero is None  # Anchored on this event, so it can only be late by the time taken to apply it.
+
+        if first_pass:
+            time_zero = time() - event.start_time / speed
+
+        # Take this event and any later ones which are already due. Normally this is just the one event, but
+        # if we are running behind, or playing fast, the frames in between are skipped and only the final
+        # state of each display is handed over.
+        data_time = max((time() - time_zero) * speed, event.start_time)
+
+        m = n + 1
 
-        end_time = time()
+        while m < len(data) and data[m].start_time <= data_time:
+            m += 1
 
-        wait_time = event.start_time - previous_start_time - (end_time - start_time)
+        # First, go and get all the IDs of the displays that are to be updated, with how many of the
+        # events update each and the last one that does.
+        updates = {}
 
-        previous_start_time = event.start_time
+        for index in range(n, m):
+            for ID in set(data[index].display_IDs):
+                updates[ID] = (updates[ID][0] + 1 if ID in updates else 1, index)
+
+        # Then, use these IDs so we only copy the buffers once.
+        for ID in updates:
+            g_displays[ID].copy_buffer()
+
+        # Finally, actually do the pixel updates.
+        for index in range(n, m):
+            for x, y, color, ID in data[index]:
+                g_displays[ID].set_buffer_pixel(x, y, color)
 
-        if wait_time < EVENT_TIME_DIFFERENCE_TOLERANCE:
+        wait_time = time_zero + data[m-1].start_time / speed - time()
+
+        if wait_time < 0.0:
             if (time() - time_last_error_msg) > 1.0 and not first_pass:
                 print('Warning: time to update frame longer than time between events.')
                 time_last_error_msg = time()
         else:
-            sleep(wait_time)
+            g_stop.wait(wait_time)
+
+        if g_break:
+            # Stopped while waiting, e.g. paused. These events haven't been shown, so playback can carry on from them.
+            for ID in updates:
+                g_displays[ID].discard_buffer()
+
+            break
+
+        # The pre-processed events are now ready to be displayed, hand the frames over to the display thread.
+        # If the bus has fallen behind, this replaces any frame still waiting to be sent for that display.
+        for ID, (count, index) in updates.items():
+            display = g_displays[ID]
+
+            if count == 1 and (index, ID) in covered and ID in animating:
+                display.skip_frame()  # The matrix is already playing this frame as part of an animation.
+                continue
+
+            # Animations are only started from a single update, as skipped frames may have been part of them.
+            animation = animations.get((index, ID)) if count == 1 else None
+
+            if animation is not None:
+                frames, interval = animation
+                animation = (frames, interval / speed) if 0.001 < interval / speed <= 65.535 else None
+
+            display.queue_frame(animation)
+
+            if animation is None:
+                animating.discard(ID)
+            else:
+                animating.add(ID)
+
+        n = m
+        g_position = (n, data[m-1].start_time)
+
+        if n == len(data) and (loops == 0 or loop + 1 < loops):
+            # Rewind for the next loop. The displays and data are kept as they are, so all that's needed is to
+            # hold the last frame for a frame, clear the displays, and re-anchor the schedule on the first event.
+            g_stop.wait(FRAME_RATE)
+
+            queue_clear_frames()
+
+            animating.clear()
+
+            time_zero = None
+            n = 0
+            g_position = (0, None)
+            loop += 1
+
+    g_break = True
+
+
+def stop_playback():
+    ''' Stops the data manager, even part way through waiting for the next event. '''
+
+    global g_break
+
+    g_break = True
+    g_stop.set()
+
+
+def queue_clear_frames():
+    ''' Queues a cleared frame for every display which isn't already showing one. '''
+
+    global g_displays
+
+    for display in g_displays:
+        display.copy_buffer()  # So the changes are counted against what the display is showing.
+        display.set_buffer_frame([COLOR_DEFAULT] * display.size * display.size)
+
+        # The mirrors are sent their principal's frame. Only in timelines stored before that, which have their own
+        # events for the mirrors, does a mirror's own frame change, and so need clearing too.
+        if display.buffer_changes > 0:
+            display.queue_frame()
+
+
+def seek(data, start_time, data_file=''):
+    ''' Queues the frame every display should be showing at start_time, and returns the index of the event
+        playback should carry on from. A stored timeline keeps its time index next to it, so it's only built once. '''
+
+    global g_displays
+
+    num_displays = max(display.ID for display in g_displays) + 1
+    size = g_displays[0].size
+
+    timeline = load_timeline(data_file, num_displays, size, events=data) if data_file != '' else Timeline(data, num_displays, size)
+
+    start, frames = timeline.seek(start_time)
+
+    for display in g_displays:
+        display.copy_buffer()  # So the changes are counted against what the display is showing.
+        display.set_buffer_frame(frames[display.ID])
+
+        # The mirrors are sent their principal's frame. Only in timelines stored before that, which have their own
+        # events for the mirrors, does a mirror's own frame change, and so need sending too.
+        if not display.mirror or display.buffer_changes > 0:
+            display.queue_frame()
+
+    return start
+
+
+def get_upload_stats():
+    ''' Returns a dict of the frames dropped, the worst wait for an upload and the bus errors of each device, as
+        (channel, address) -> errors. '''
+
+    return {'frames_dropped': sum(display.frames_dropped for display in g_displays),
+            'worst_wait': max(display.worst_wait for display in g_displays),
+            'bus_errors': g_bus.get_error_counts() if isinstance(g_bus, ResilientBus) else {}}
 
-        # The pre-processed event is now ready to be displayed, switch the buffers and set the update flags for the display thread.
-        for ID in updated_display_IDs:
-            g_displays[ID].switch_buffer()
-            g_displays[ID].needs_updating = True
 
-        first_pass = False
+def print_upload_stats():
+    stats = get_upload_stats()
+
+    print('Frames dropped', stats['frames_dropped'])
+    print('Worst upload wait', stats['worst_wait'])
+
+    for (channel, address), errors in sorted(stats['bus_errors'].items(), key=str):
+        print(f'Bus errors for device {address:#x} on channel {channel}: {errors}')
+
+
+def ring_reader(ring):
+    ''' Hands the frames from the ring to the displays, as data_manager would, until the end of the frames. '''
+
+    global g_displays
+    global g_break
+
+    from ring import END_OF_FRAMES
+
+    while True:
+        ID, frame, animation, changes, queued = ring.read()
+
+        if ID == END_OF_FRAMES:
+            break
+
+        display = g_displays[ID]
+
+        # Any mirrors are handed the same frame, as in Display.queue_frame.
+        for d in [display] + display.mirrors:
+            d.hand_over_frame(frame, animation, changes, queued, mirrored=d is not display)
+
+    g_break = True
+
+
+def bus_process_stopped(process_bus):
+    ''' Whether a frame waiting for room in the ring to the bus process should give up: when playback is stopping, or
+        when the bus process has died, as nothing will make room then, in which case playback is stopped. '''
+
+    global g_break
+
+    if not g_break and not process_bus.is_alive():
+        print('Warning: the bus process has stopped, so stopping playback.')
+        stop_playback()
+
+    return g_break
+
+
+def bus_process(ring, profile_file=''):
+    ''' The bus process started by run with processes=True. It only uploads: one thread reads the frames from the ring
+        and the display thread uploads them as usual. The bus and displays are inherited from the parent process. '''
+
+    global g_break
+
+    from signal import signal, SIGINT, SIG_IGN
+
+    signal(SIGINT, SIG_IGN)  # The parent stops playback on Ctrl-C, then tells this process through the ring.
+
+    g_break = False
+
+    if profile_file != '':
+        enable_profiling()  # Only the uploads are timed here, the parent times everything else.
+
+    thread_reader = Thread(target=ring_reader, args=(ring,), name='Ring')
+    thread_reader.start()
+
+    display_manager()
+
+    thread_reader.join()
+
+    print_upload_stats()
+
+    if profile_file != '':
+        save_chrome_trace(profile_file + '.bus', disable_profiling())
+
+    ring.close()
+
 
 def preprocess_data(file_=None, mode=MODE_DEFAULT,
         energy_method=ENERGY_METHOD_DEFAULT, 
-        normalise=True, mirror=False, out_file='example'):
+        normalise=True, mirror=False, out_file='example', profile_file=''):
     global g_displays
+    from data import process_data
+
+    # If a profile file is given, the time and memory of each pre-processing stage is saved there as a Chrome trace.
+    if profile_file != '':
+        enable_profiling(allocations=True)
+
     time_start = time()
     data = process_data(file_, g_displays, mode=mode, energy_method=energy_method, normalise=normalise, mirror=mirror)
     storeData(_file=out_file,data=data)
     time_end = time()
     print(f'Pre-processing complete in {time_end-time_start}s', )
 
+    if profile_file != '':
+        print_report()
+        save_chrome_trace(profile_file, disable_profiling())
+
 def run(file_=None, layout=None, bus=None, displays=None, mode=MODE_DEFAULT,
         energy_method=ENERGY_METHOD_DEFAULT,
-        force_displays=False, normalise=True, mirror=False,data_file=''):
+        force_displays=False, normalise=True, mirror=False,data_file='', animate=False, speed=1.0, profile_file='',
+        start_time=None, loops=1, processes=False, live=False):
     global g_displays
+    global g_break
+    global g_live
 
     if file_ is not None:
         assert isinstance(file_, str)
@@ -160,32 +414,105 @@ def run(file_=None, layout=None, bus=None, displays=None, mode=MODE_DEFAULT,
     assert isinstance(force_displays, bool)
     assert isinstance(normalise, bool)
     assert isinstance(mirror, bool)
+    assert isinstance(animate, bool)  # Should steady sequences of frames, e.g. fades, be uploaded once and played by the matrix?
+    assert isinstance(speed, (float, int))
+    assert speed > 0.0, 'Speed should be > 0.0.'  # Playback speed factor, e.g. 0.25 for quarter speed or 20 for 20x.
+
+    if start_time is not None:
+        assert isinstance(start_time, (float, int))  # Data time to start playing from, rather than the beginning.
+
+    assert isinstance(loops, int)
+    assert loops >= 0, 'Loops should be >= 0.'  # How many times to play the data, 0 to repeat it until interrupted.
+    assert isinstance(processes, bool)  # Should the bus be driven from a separate process, so nothing else here can delay it?
+    assert isinstance(live, bool)  # Should every uploaded frame be published to shared memory, for plot_displays.py --live?
+
+    # If a profile file is given, the time of each stage, including every upload, is saved there as a Chrome trace.
+    # Allocations aren't traced, as that would slow down playback too much.
+    if profile_file != '':
+        enable_profiling()
 
     time_start = time()
 
     initialise(layout, bus, displays, force_displays, mirror)
     if data_file == '':
+        from data import process_data
         data = process_data(file_, g_displays, mode=mode, energy_method=energy_method, normalise=normalise, mirror=mirror)
     else:
         data = loadData(data_file)
 
     thread_display = Thread(target=display_manager, name='Display')
-    thread_data = Thread(target=data_manager, args=(data,), name='Data')
+    animations = get_animations(data, size=g_displays[0].size) if animate else None
+
+    if live:
+        # Made before the bus process is forked, so whichever process uploads publishes to the same memory.
+        from live import LiveFrames
+
+        g_live = LiveFrames.create(max(display.ID for display in g_displays) + 1, size=g_displays[0].size)
+
+    if processes:
+        # The bus process is forked, so it has the bus and displays as they are now. Only after that are this
+        # process's displays set to send their frames down the ring, rather than to a display thread here.
+        from multiprocessing import get_context
+        from ring import FrameRing
+
+        context = get_context('fork')
+
+        ring = FrameRing(size=g_displays[0].size, context=context)
+
+        process_bus = context.Process(target=bus_process, args=(ring, profile_file), name='Bus')
+        process_bus.start()
+
+        ring.give_up = lambda: bus_process_stopped(process_bus)
+
+        for display in g_displays:
+            display.frame_sink = ring.write
+
+    start = 0
+
+    if start_time is not None:
+        start = seek(data, start_time, data_file)
+
+    thread_data = Thread(target=data_manager, args=(data, animations, speed, start, start_time, loops), name='Data')
 
     time_middle = time()
-    
-    thread_display.start()
+
+    if not processes:
+        thread_display.start()
+
     thread_data.start()
-    
-    thread_display.join()
-    thread_data.join()
+
+    try:
+        thread_data.join()
+    except KeyboardInterrupt:  # The way to stop looping forever, let both threads finish cleanly.
+        stop_playback()
+        thread_data.join()
+
+    if processes:
+        ring.write_end(give_up=lambda: not process_bus.is_alive())  # Not g_break, which is set by now, so the last frames are still sent.
+        process_bus.join()
+        ring.close(unlink=True)
+
+        for display in g_displays:
+            display.frame_sink = None
+    else:
+        thread_display.join()
     
     time_end = time()
     
     print('Initialisation time', time_middle-time_start)
     print('Run time', time_end-time_middle)
+
+    if not processes:
+        print_upload_stats()
+
+    if profile_file != '':
+        print_report()
+        save_chrome_trace(profile_file, disable_profiling())
     
     clear_displays(g_bus, g_displays)
 
+    if g_live is not None:
+        g_live.close()
+
     reset()
 
@@ -1,4 +1,4 @@
-from numpy import pi as numpy_pi
+from math import pi as math_pi
 
 
 #The device i2c address in default
@@ -85,6 +85,8 @@ ENERGY_METHOD_DEFAULT = 'accumulate'  # Should the energy of a pixel tick away o
 
 ENERGY_TICK_RATE_DEFAULT = 5.0  # Every `GRADIENT_DELAY` seconds, the energy of a pixel should decay by how much?
 
+VALIDATE_DEFAULT = False  # Should each stage of pre-processing check its whole output? Slower, but catches bad data early.
+
 PHASE_MODE_TICKS = 2  # How many ticks should occur for each data point if in phase mode?
 
 WAIT_WRITE = 0.001 # Time to wait for Bus after a write statement.
@@ -92,6 +94,30 @@ WAIT_READ = 0.1 # Time to wait for Bus after a read statement
 WAIT_INITIAL = 0.1 # Time to wait for Bus on startup.
 WAIT_DISPLAY = 0.0001 # How long should the display thread wait before checking if any updates to the displays are needed?
 
+BUS_FREQUENCY = 100000  # I2C clock (Hz), the Pi's default. Only used to estimate upload times when planning.
+
+ANIMATION_FRAMES_MAX = 5  # Most frames the matrix can hold for a custom (multi-frame) display.
+ANIMATION_TIME_TOLERANCE = 0.001  # Updates to a display this close (s) to a steady interval are treated as part of an animation.
+
+TIMELINE_CHECKPOINT_INTERVAL = 1000  # Every this many events, a timeline keeps a copy of every display's frame so it can seek quickly.
+
+RING_RECORDS = 256  # How many frames can be waiting in the ring between the data and bus processes?
+RING_WAIT = 0.1  # How often (s) a writer waiting for room in a full ring checks whether to give up.
+
+LIVE_FRAMES_NAME = 'led_display_live'  # Shared memory a viewer attaches to, to watch what every display is showing.
+
+DAEMON_SOCKET = '/tmp/led_display.sock'  # Unix socket daemon.py takes its commands on.
+
+UPLOAD_STALENESS_MAX = 0.5  # Once a display has waited this long (s) for an upload it is served first, whatever its channel.
+UPLOAD_PIXEL_WEIGHT = 0.001  # Each changed pixel in a pending frame counts as this much extra waiting time (s) when ordering uploads.
+
+BUS_RETRIES_MAX = 3  # How many times should a failed bus write be retried before giving up on it?
+BUS_BACKOFF_INITIAL = 0.002  # Wait (s) before the first retry, doubled for each retry after that...
+BUS_BACKOFF_MAX = 0.05  # ... up to this long.
+BUS_BREAKER_THRESHOLD = 3  # After this many writes in a row fail, each having used up all its retries, a device is left alone for a while.
+BUS_BREAKER_COOLDOWN = 1.0  # How long (s) a failing device is left alone before it is tried again...
+BUS_BREAKER_COOLDOWN_MAX = 30.0  # ... doubling each time that try fails, up to this long.
+
 DEVICE_NUM_MIN = 8 # Minimum device number sensible as in `i2cdetect -y 1`.
 DEVICE_NUM_MAX = 110 # Maximum device number sensible as in `i2cdetect -y 1`
 
@@ -107,10 +133,15 @@ GRADIENT_DELAY_PHASE = GRADIENT_DELAY / 5.0  # How long is the time between data
 #EVENT_TIME_DIFFERENCE_TOLERANCE = 0.001  # If two pixel light-ups are within this time frame, then they are updated at the same time.
 EVENT_TIME_DIFFERENCE_TOLERANCE = 1.0  # If two pixel light-ups are within this time frame, then they are updated at the same time.
 
+# The columns of a data file and the compact type each is read as. Times stay double precision, so long runs keep
+# their sub-millisecond resolution, while the rest fit comfortably in the smaller types.
+DATA_COLUMNS = ['time', 'ID', 'side', 'x', 'y', 'energy']
+DATA_DTYPES = {'time': 'float64', 'ID': 'uint32', 'side': 'uint8', 'x': 'int16', 'y': 'int16', 'energy': 'float32'}
+
 EXAMPLE_DATA = [(1.00, 999, 0, 3, 3, 18.0), (2.75, 999, 0, 3, 3, 20.0)]
 
 LETTERS = list('ABCDEFGJKLMPQRTUVWY')  # Usable letters for arranging the displays. These have no awkward symmetries.
 
-PI = float(numpy_pi)
+PI = float(math_pi)
 
 SMALL_NUMBER = 0.0000000001
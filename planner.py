@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+from argparse import ArgumentParser
+from collections import Counter
+
+from display import get_next_display, get_sim_displays
+from parameters import BUS_FREQUENCY, I2C_MULTIPLEXER_CHANNEL_IDs, WAIT_WRITE
+from timeline import loadData
+
+# Example, to check a two sided layout with 4 displays on each multiplexer channel can keep up with a timeline:
+#   python planner.py Processed_data/example1 --layout 4 4 --mirror --per-channel 4
+# Or with the time an upload actually takes, e.g. from the 'upload' stage of a profile of a run on the hardware:
+#   python planner.py Processed_data/example1 --layout 4 4 --upload-time 0.006
+
+
+def get_write_time(num_bytes, frequency=BUS_FREQUENCY):
+    ''' Estimated time for one bus write of num_bytes data bytes, plus the wait after it. Each byte on the bus is
+        9 clocks (8 bits and an ack), and every write also sends the device address and command. '''
+
+    return 9 * (num_bytes + 2) / frequency + WAIT_WRITE
+
+
+def get_upload_time(size=8, frequency=BUS_FREQUENCY):
+    ''' Estimated time to upload one frame, as in Display.display_current_frame: a 7 byte header and the frame in two halves. '''
+
+    return get_write_time(7, frequency) + 2 * get_write_time(size * size // 2, frequency)
+
+
+class PlannedDisplay:
+    ''' The upload state of a display while planning. Has the attributes get_next_display looks at, so uploads are
+        ordered just as on the hardware. '''
+
+    __slots__ = ('ID', 'channel', 'mirrors', 'needs_updating', 'retry_after', 'pending_since', 'pending_changes',
+                 'uploads', 'frames_dropped', 'total_lateness', 'worst_lateness')
+
+    def __init__(self, ID, channel):
+        self.ID = ID
+        self.channel = channel
+        self.mirrors = []
+
+        self.needs_updating = False
+        self.retry_after = 0.0
+        self.pending_since = 0.0
+        self.pending_changes = 0
+
+        self.uploads = 0
+        self.frames_dropped = 0
+        self.total_lateness = 0.0  # Time from each frame being queued to it having been uploaded.
+        self.worst_lateness = 0.0
+
+    def queue(self, now, changes):
+        if self.needs_updating:
+            self.frames_dropped += 1
+        else:
+            self.pending_since = now
+
+        self.needs_updating = True
+        self.pending_changes += changes
+
+
+def get_planned_displays(displays, per_channel):
+    ''' Gives the displays channels in ID order, per_channel to each, and links the mirrors to their principals. '''
+
+    planned = {}
+
+    for n, display in enumerate(sorted(displays, key=lambda d: d.ID)):
+        assert n // per_channel < len(I2C_MULTIPLEXER_CHANNEL_IDs), 'Not enough multiplexer channels for this many displays.'
+
+        planned[display.ID] = PlannedDisplay(display.ID, I2C_MULTIPLEXER_CHANNEL_IDs[n // per_channel])
+
+    for display in displays:
+        planned[display.ID].mirrors = [planned[mirror.ID] for mirror in display.mirrors]
+
+    return planned
+
+
+def plan(events, displays, per_channel=8, upload_time=None, switch_time=None, window=1.0):
+    ''' Plays the events through a model of the display thread and returns a dict with the planned displays, the
+        peak backlog (most displays waiting at once) and, for each `window` seconds, the upload time demanded if every
+        update were sent and the time the bus actually spent busy. A window needing more than `window` seconds of
+        uploads is over capacity. '''
+
+    assert per_channel > 0, 'Need at least one display per channel.'
+    assert window > 0.0, 'Window should be > 0.0.'
+
+    size = displays[0].size
+
+    upload_time = get_upload_time(size) if upload_time is None else upload_time
+    switch_time = get_write_time(1) if switch_time is None else switch_time
+
+    planned = get_planned_displays(displays, per_channel)
+
+    demand = {}  # Window index -> upload time needed to send every update.
+    busy = {}  # Window index -> time the bus spent uploading.
+
+    time_zero = events[0].start_time if len(events) > 0 else 0.0
+
+    now = time_zero
+    channel = None
+    backlog = 0
+
+    n = 0
+
+    while True:
+        # Hand over the updates of every event due by now, as the data thread would.
+        while n < len(events) and events[n].start_time <= now:
+            event = events[n]
+            window_index = int((event.start_time - time_zero) // window)
+
+            for ID, changes in Counter(event.display_IDs).items():
+                for display in [planned[ID]] + planned[ID].mirrors:
+                    display.queue(event.start_time, changes)
+                    demand[window_index] = demand.get(window_index, 0.0) + upload_time
+
+            n += 1
+
+        backlog = max(backlog, sum(display.needs_updating for display in planned.values()))
+
+        display = get_next_display(planned.values(), channel, now=now)
+
+        if display is None:
+            if n == len(events):
+                break
+
+            now = events[n].start_time  # Nothing to do until the next event.
+
+            continue
+
+        cost = upload_time + (switch_time if display.channel != channel else 0.0)
+        channel = display.channel
+
+        # Count the busy time against the window(s) the upload falls in.
+        start = now
+        now += cost
+
+        while start < now:
+            window_index = int((start - time_zero) // window)
+            end = min(now, time_zero + (window_index + 1) * window)
+            busy[window_index] = busy.get(window_index, 0.0) + end - start
+            start = end
+
+        lateness = now - display.pending_since
+
+        display.uploads += 1
+        display.total_lateness += lateness
+        display.worst_lateness = max(display.worst_lateness, lateness)
+        display.needs_updating = False
+        display.pending_changes = 0
+
+    return {'displays': planned, 'backlog': backlog, 'demand': demand, 'busy': busy,
+            'upload_time': upload_time, 'switch_time': switch_time, 'window': window, 'time_zero': time_zero,
+            'duration': (events[-1].start_time - time_zero) if len(events) > 0 else 0.0, 'end': now}
+
+
+def print_plan(result):
+    window = result['window']
+    windows = sorted(set(result['demand']) | set(result['busy']))
+
+    print(f'Upload time {result["upload_time"] * 1000:.2f} ms per frame, channel switch {result["switch_time"] * 1000:.2f} ms')
+    print(f'Capacity {1.0 / result["upload_time"]:.0f} frames per second')
+
+    if len(windows) > 0:
+        peak = max(result['demand'].values(), default=0.0) / window
+        mean = sum(result['demand'].values()) / (len(windows) * window)
+        print(f'Upload demand: mean {mean:.2f}, peak {peak:.2f} seconds of uploads per second')
+
+    print(f'Peak backlog {result["backlog"]} displays waiting')
+    print(f'Playback would finish {result["end"] - result["time_zero"] - result["duration"]:.3f} s after the last event')
+
+    print(f'{"Display":>8} {"Channel":>8} {"Uploads":>8} {"Dropped":>8} {"Mean late (s)":>14} {"Worst late (s)":>15}')
+
+    for ID, display in sorted(result['displays'].items()):
+        mean = display.total_lateness / display.uploads if display.uploads > 0 else 0.0
+        print(f'{ID:8d} {display.channel:#8x} {display.uploads:8d} {display.frames_dropped:8d} {mean:14.4f} {display.worst_lateness:15.4f}')
+
+    over = [w for w in windows if result['demand'].get(w, 0.0) > window]
+
+    if len(over) == 0:
+        print('No windows over capacity.')
+    else:
+        print(f'{len(over)} of {len(windows)} windows over capacity:')
+
+        for w in over:
+            start = result['time_zero'] + w * window
+            print(f'  {start:10.3f} - {start + window:10.3f} s: needs {result["demand"][w]:.3f} s of uploads, '
+                  f'bus busy {result["busy"].get(w, 0.0):.3f} s')
+
+
+def main(args=None):
+    parser = ArgumentParser(description='Predict whether the bus can keep up with a pre-processed timeline on a layout.')
+    parser.add_argument('timeline', help='Pre-processed timeline, as written by storeData.')
+    parser.add_argument('--layout', type=int, nargs='+', default=None, help='Number of displays on each side, e.g. --layout 4 4.')
+    parser.add_argument('--mirror', action='store_true', help='Each display has a mirror display behind it.')
+    parser.add_argument('--per-channel', type=int, default=8, help='Displays on each multiplexer channel, given in ID order.')
+    parser.add_argument('--upload-time', type=float, default=None, help='Measured time (s) to upload a frame, rather than the estimate.')
+    parser.add_argument('--switch-time', type=float, default=None, help='Measured time (s) to switch channel, rather than the estimate.')
+    parser.add_argument('--window', type=float, default=1.0, help='Length (s) of the windows demand is reported over.')
+
+    args = parser.parse_args(args)
+
+    events = loadData(args.timeline)
+    displays = get_sim_displays(layout=tuple(args.layout) if args.layout is not None else None, mirror=args.mirror)
+
+    num_displays = max(display.ID for display in displays) + 1
+
+    assert all(ID < num_displays for event in events for ID in event.display_IDs), 'Timeline has updates for displays not in the layout.'
+
+    print_plan(plan(events, displays, per_channel=args.per_channel, upload_time=args.upload_time,
+                    switch_time=args.switch_time, window=args.window))
+
+
+if __name__ == '__main__':
+    main()
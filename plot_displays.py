@@ -1,122 +1,194 @@
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-import pandas as pd
-from manager import process_data
-from display import Display
-from parameters import DEFAULT_I2C_ADDR
-import pickle
-def get_sim_displays(layout=None):
-    from numpy import ceil, sqrt
-    if layout is not None:
-        if isinstance(layout, int):
-            layout = (layout,)  # If a single number is supplied, turn it into a tuple.
-        else:
-            assert isinstance(layout, tuple)
-            assert all(isinstance(i, int) for i in layout)
-
-    addresses = [DEFAULT_I2C_ADDR]
-
-    # If a layout was supplied, ensure we have at least enough devices.
-    if layout is not None:
-        if len(addresses) < sum(layout):
-                addresses *= 1 + sum(layout) // len(addresses)  # Duplicate addresses until we have enough.
-
-        # We only keep the addresses that are needed if a layout is supplied.
-        addresses = addresses[:sum(layout)]
-
-    else:  # Just create a dummy layout if none was supplied.
-        layout = (len(addresses),)
-
-    # Let's now create the Display objects.
-    displays = []
-
-    # The side, X and Y data for each display.
-    coordinates = [[divmod(n, int(ceil(sqrt(side_size)))) for n in range(side_size)] for side_size in layout]
-
-    current_ID = 0
-
-    for (side, YXs) in enumerate(coordinates):
-        for Y, X in YXs:  # divmod() gives (Y, X) co-ordinates so need to be careful.
-            displays.append(Display(side=side, X=X, Y=Y, ID=current_ID, address=addresses[current_ID]))
-            current_ID += 1
-
-    return displays
-
-def update(i, pixels,event):
-    """
-    Update the pixel values based on the provided data.
-    
-    Parameters:
-    i (int): Index of the current data point.
-    data (DataFrame): Data containing 'x', 'y', and 'energy' columns.
-    data_raw (DataFrame): Raw data containing 'energy' column for maximum value.
-    """
-    pos_y = [0,0,8,8]
-    pos_x = [0,8,0,8]
-
-    for k, disp_ID in enumerate(event[i].display_IDs):
-        det_x = event[i].x_values[k] + pos_x[(disp_ID % 4)]
-        det_y = event[i].y_values[k] + pos_y[(disp_ID % 4)]
-        det_ID=int(np.floor(disp_ID)/4)
-# Update the pixel at the specified coordinates with the energy value
-        pixels[det_ID][det_x,det_y] = event[i].colors[k]
-
-    for j,disp in enumerate(pixels):
-        ax[j].imshow(pixels[j], interpolation="nearest", origin="upper",cmap='jet',vmax=255)
-    return 
-
-
-def draw_screen(ax,layout=(4,4)):
-    from matplotlib.patches import Rectangle
-
-    for screen_id in range(len(layout)*2):
-        ax[screen_id].set_xlim(-1, 16 + 1)
-        ax[screen_id].set_ylim(-1, 16 + 1)
-        ax[screen_id].set_aspect('equal')
-        # Draw the screen
-
-        for i in range(2):
-            for j in range(2):
-                bound_x = i * 8
-                bound_y = j * 8
-                screen = Rectangle((bound_x, bound_y), 8, 8, linewidth=1, edgecolor='black', facecolor='none')
-                ax[screen_id].add_patch(screen)
-        # set title ect..
-        ax[screen_id].set_title(f'Detector {screen_id + 1}')
-        ax[screen_id].axis('off')  # Hide axes
-
-
-# pixels=[np.zeros((16,16))]
+from itertools import count
+from time import time
+from display import Display, get_sim_displays
+from live import LiveFrames
+from parameters import FRAME_RATE
+from timeline import loadData
+
+
+class SimRenderer:
+    ''' Plays a timeline of events on a simulated set of detectors, one plot per side of the layout.
+        The image of each detector is created once and then only its data is updated, with blitting,
+        so only the images which have changed are redrawn each frame. '''
+
+    def __init__(self, displays, events, speed=1.0):
+        assert all(isinstance(display, Display) for display in displays)
+        assert len({display.size for display in displays}) == 1, 'Can currently only work with all displays of equal size.'
+        assert isinstance(speed, (float, int))
+        assert speed > 0.0, 'Speed should be > 0.0.'
+
+        self.size = displays[0].size
+        self.events = events
+        self.speed = speed
+
+        principals = [display for display in displays if not display.mirror]  # Mirror displays just show the same thing.
+
+        self.num_sides = max(display.side for display in principals) + 1
+        self.len_X = max(display.X for display in principals) + 1
+        self.len_Y = max(display.Y for display in principals) + 1
+
+        # Lookup tables from display ID to which detector it is on and where. Displays not in the layout have side -1.
+        num_IDs = max(display.ID for display in displays) + 1
+
+        self.sides = np.full(num_IDs, -1, dtype=int)
+        self.x_offsets = np.zeros(num_IDs, dtype=int)
+        self.y_offsets = np.zeros(num_IDs, dtype=int)
+
+        for display in principals:
+            self.sides[display.ID] = display.side
+            self.x_offsets[display.ID] = display.X * self.size
+            self.y_offsets[display.ID] = display.Y * self.size
+
+        # The pixels of every detector, starting blank. As before, the pixel x value is the row and y the column.
+        self.pixels = np.zeros((self.num_sides, self.len_X * self.size, self.len_Y * self.size), dtype=np.uint8)
+
+        self.next_event = 0
+        self.time_zero = None  # Wall clock time corresponding to the first event.
+
+    def apply_event(self, event):
+        ''' Applies all the pixel changes of an event to the detector arrays in one go. '''
+
+        IDs = np.asarray(event.display_IDs, dtype=int)
+
+        shown = (IDs < len(self.sides))
+        shown[shown] = self.sides[IDs[shown]] >= 0
+
+        IDs = IDs[shown]
+
+        rows = np.asarray(event.x_values, dtype=int)[shown] + self.x_offsets[IDs]
+        cols = np.asarray(event.y_values, dtype=int)[shown] + self.y_offsets[IDs]
+
+        self.pixels[self.sides[IDs], rows, cols] = np.asarray(event.colors, dtype=np.uint8)[shown]
+
+        return set(self.sides[IDs].tolist())
+
+    def draw(self, fig, ax):
+        ''' Draws the outline of every display and creates the image of each detector. '''
+
+        from matplotlib.patches import Rectangle
+
+        self.images = []
+
+        for side in range(self.num_sides):
+            ax[side].set_xlim(-1, self.len_Y * self.size + 1)
+            ax[side].set_ylim(-1, self.len_X * self.size + 1)
+            ax[side].set_aspect('equal')
+
+            # Draw the screens.
+            for i in range(self.len_Y):
+                for j in range(self.len_X):
+                    screen = Rectangle((i * self.size, j * self.size), self.size, self.size, linewidth=1, edgecolor='black', facecolor='none')
+                    ax[side].add_patch(screen)
+
+            # set title ect..
+            ax[side].set_title(f'Detector {side + 1}')
+            ax[side].axis('off')  # Hide axes
+
+            self.images.append(ax[side].imshow(self.pixels[side], interpolation='nearest', origin='upper', cmap='jet',
+                                               vmin=0, vmax=255, animated=True))
+
+        return self.images
+
+    def get_frames(self):
+        ''' Yields until all events have been shown, so the animation knows when to stop. '''
+
+        while self.next_event < len(self.events):
+            yield self.next_event
+
+    def update(self, frame):
+        ''' Applies every event which is due by now, keeping up with the data time however many that is. '''
+
+        if self.time_zero is None:
+            self.time_zero = time() - self.events[0].start_time / self.speed
+
+        now = (time() - self.time_zero) * self.speed
+
+        changed_sides = set()
+
+        while self.next_event < len(self.events) and self.events[self.next_event].start_time <= now:
+            changed_sides |= self.apply_event(self.events[self.next_event])
+            self.next_event += 1
+
+        for side in changed_sides:
+            self.images[side].set_data(self.pixels[side])
+
+        return [self.images[side] for side in sorted(changed_sides)]
+
+    def animate(self, repeat=False):
+        fig, ax = plt.subplots(1, self.num_sides, figsize=(8, 8), squeeze=False)
+
+        self.draw(fig, ax[0])
+
+        return animation.FuncAnimation(fig, self.update, frames=self.get_frames, init_func=lambda: self.images,
+                                       interval=FRAME_RATE * 1000, blit=True, repeat=repeat, cache_frame_data=False)
+
+
+class LiveRenderer(SimRenderer):
+    ''' Shows what the displays of a running manager.run(..., live=True) are showing, read from its LiveFrames.
+        The displays should be made with the same layout as the ones being played. Nothing is redrawn unless a
+        frame has been uploaded since the last look. '''
+
+    def __init__(self, displays, live):
+        assert isinstance(live, LiveFrames)
+        assert live.size == displays[0].size, 'Displays are not the size of those being played.'
+
+        super().__init__(displays, events=[])
+
+        self.live = live
+        self.generation = None
+
+        self.principal_IDs = [display.ID for display in displays
+                              if not display.mirror and display.ID < live.num_displays]
+
+    def get_frames(self):
+        ''' Yields forever, the player may run for as long as it likes. '''
+
+        return count()
+
+    def update(self, frame):
+        self.generation, frames = self.live.read(self.generation)
+
+        if frames is None:
+            return []
+
+        # Each frame is indexed [y, x], whereas the detector arrays have x as the row.
+        frames = np.frombuffer(frames, dtype=np.uint8).reshape(-1, self.size, self.size)
+
+        for ID in self.principal_IDs:
+            x, y = self.x_offsets[ID], self.y_offsets[ID]
+            self.pixels[self.sides[ID], x:x + self.size, y:y + self.size] = frames[ID].T
+
+        for side in range(self.num_sides):
+            self.images[side].set_data(self.pixels[side])
+
+        return self.images
+
+
 if __name__=='__main__':
     layout = (4,4,4,4,4,4)
 
-    pixels = []  # List to hold pixel arrays for each screen
-    for i in range(len(layout)*2):
-        # Create a 16x16 pixel array for each screen
-        # Initialize with zeros (black)
-        pixels.append(np.zeros((16,16)))
-
     file_ = 'test_data/big.csv'  # Data file.
-    
-    force_displays = False  # If we request more displays than addresses found, should we reuse displays anyway?
 
     displays = get_sim_displays(layout=layout)
-    # process data into stream of events
 
-   # data = process_data(file_, displays, mode='normal', energy_method='tick', normalise=True)
-    print ('loading data from Processed_data/example1')
-    dbfile = open('Processed_data/example1', 'rb')    
-    data = pickle.load(dbfile)
-    dbfile.close()
-    print ('Data loaded')
-    #setup plots 
-    fig, ax = plt.subplots(1,len(layout)*2, figsize=(8,8))
+    if '--live' in sys.argv[1:]:  # Watch the displays of a manager.run(..., live=True) instead, with the same layout.
+        renderer = LiveRenderer(displays, LiveFrames.attach())
+    else:
+        # process data into stream of events
+
+       # from data import process_data  # Only imported if needed, it pulls in pandas and tqdm.
+       # data = process_data(file_, displays, mode='normal', energy_method='tick', normalise=True)
+        print ('loading data from Processed_data/example1')
+        data = loadData('Processed_data/example1')
+        print ('Data loaded')
 
-    draw_screen(ax,layout=layout)
+        renderer = SimRenderer(displays, data)
 
-    ani = animation.FuncAnimation(fig, update, len(data), interval=2000, fargs=[pixels,data], blit=False,repeat=True)
+    ani = renderer.animate()
     plt.show()
     # save as animated gif
     #ani.save('animation_drawing.gif', writer='imagemagick',fps=1)
-
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from time import time
+
+from parameters import MODES, MODE_DEFAULT, ENERGY_METHODS, ENERGY_METHOD_DEFAULT
+
+# Example, to pre-process every data file for a two sided layout using 4 worker processes:
+#   python preprocess.py 'Imaging_data/*.dat' --layout 4 4 --energy-method tick --mirror --jobs 4
+
+
+def get_out_file(in_file, out_dir):
+    ''' Where the pre-processed timeline for a data file is written. '''
+
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(in_file))[0])
+
+
+def get_settings_file(out_file):
+    ''' Holds the input file details and parameters that the timeline was made from, so we can tell if it is up to date. '''
+
+    return out_file + '.json'
+
+
+def get_stats_file(out_file):
+    ''' Holds the per-pixel hit, energy and update counts, if they were asked for. '''
+
+    return out_file + '.stats.npz'
+
+
+def get_settings(in_file, parameters):
+    stat = os.stat(in_file)
+
+    return {'input': os.path.abspath(in_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'parameters': parameters}
+
+
+def is_up_to_date(in_file, out_file, parameters):
+    ''' A timeline is up to date if it exists and was made from this exact input file with the same parameters. '''
+
+    if not os.path.isfile(out_file):
+        return False
+
+    try:
+        with open(get_settings_file(out_file)) as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    return settings == get_settings(in_file, parameters)
+
+
+def preprocess_file(in_file, out_file, parameters):
+    ''' Pre-processes a single data file into a timeline. This runs in a worker process. '''
+
+    from data import process_data, storeData
+    from display import get_sim_displays
+
+    time_start = time()
+
+    # Remove the old settings first, so a run which fails part way through can't leave a new timeline looking
+    # like it was made with the old parameters. The settings are written last, once the timeline is complete.
+    settings_file = get_settings_file(out_file)
+
+    if os.path.exists(settings_file):
+        os.remove(settings_file)
+
+    layout = parameters['layout']
+    displays = get_sim_displays(layout=tuple(layout) if layout is not None else None, mirror=parameters['mirror'])
+
+    data = process_data(in_file, displays, mode=parameters['mode'], energy_method=parameters['energy_method'],
+                        normalise=parameters['normalise'], mirror=parameters['mirror'], validate=parameters['validate'],
+                        stats_file=get_stats_file(out_file) if parameters['stats'] else None)
+
+    storeData(data, _file=out_file)
+
+    with open(settings_file + '.tmp', 'w') as f:
+        json.dump(get_settings(in_file, parameters), f)
+
+    os.replace(settings_file + '.tmp', settings_file)
+
+    return time() - time_start
+
+
+def preprocess_files(patterns, out_dir, parameters, jobs=None, force=False):
+    ''' Pre-processes all data files matching the given file names or glob patterns in parallel worker
+        processes, skipping any whose timeline is already up to date. Returns a dict of file -> error
+        for any files which failed. '''
+
+    assert isinstance(out_dir, str)
+    assert isinstance(force, bool)
+
+    in_files = []
+
+    for pattern in patterns:
+        matches = sorted(glob(pattern)) if any(c in pattern for c in '*?[') else [pattern]
+
+        if len(matches) == 0:
+            print(f'Warning: no files match {pattern}.')
+
+        in_files += [m for m in matches if m not in in_files]
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    jobs_todo = []
+
+    for in_file in in_files:
+        out_file = get_out_file(in_file, out_dir)
+
+        if not force and is_up_to_date(in_file, out_file, parameters):
+            print(f'Skipping {in_file}, {out_file} is up to date.')
+        else:
+            jobs_todo.append((in_file, out_file))
+
+    out_files = [out_file for _, out_file in jobs_todo]
+    assert len(set(out_files)) == len(out_files), 'Two input files would write to the same timeline.'
+
+    errors = {}
+
+    if len(jobs_todo) == 0:
+        return errors
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(preprocess_file, in_file, out_file, parameters): in_file for in_file, out_file in jobs_todo}
+
+        for future in as_completed(futures):
+            in_file = futures[future]
+
+            try:
+                print(f'Pre-processed {in_file} in {future.result():.1f}s')
+            except Exception as error:
+                print(f'Error: failed to pre-process {in_file}: {error!r}')
+                errors[in_file] = error
+
+    return errors
+
+
+def main(args=None):
+    parser = ArgumentParser(description='Pre-process data files into timelines for playback.')
+    parser.add_argument('files', nargs='+', help='Data files or glob patterns (quote them so the shell does not expand them).')
+    parser.add_argument('--out-dir', default='Processed_data', help='Directory to write the timelines to.')
+    parser.add_argument('--layout', type=int, nargs='+', default=None, help='Number of displays on each side, e.g. --layout 4 4.')
+    parser.add_argument('--mode', default=MODE_DEFAULT, choices=MODES)
+    parser.add_argument('--energy-method', default=ENERGY_METHOD_DEFAULT, choices=ENERGY_METHODS)
+    parser.add_argument('--no-normalise', action='store_true', help='Keep the data times as they are in the file.')
+    parser.add_argument('--mirror', action='store_true', help='Each display has a mirror display behind it.')
+    parser.add_argument('--validate', action='store_true', help='Check the output of each pre-processing stage.')
+    parser.add_argument('--stats', action='store_true', help='Also save the hit, energy and update counts of every pixel.')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--force', action='store_true', help='Pre-process files even if their timelines are up to date.')
+
+    args = parser.parse_args(args)
+
+    parameters = {'layout': args.layout,
+                  'mode': args.mode,
+                  'energy_method': args.energy_method,
+                  'normalise': not args.no_normalise,
+                  'mirror': args.mirror,
+                  'validate': args.validate,
+                  'stats': args.stats}
+
+    errors = preprocess_files(args.files, args.out_dir, parameters, jobs=args.jobs, force=args.force)
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,185 @@
+import json
+import os
+from threading import get_ident, Lock
+from time import perf_counter, thread_time
+
+# Opt-in timing of the stages of pre-processing and playback. Nothing is recorded unless profiling is enabled, and
+# then each stage records its wall time, the CPU time of its thread, the memory it allocated (if asked for) and how
+# many items it dealt with. For example:
+#
+#   enable_profiling(allocations=True)
+#   events = process_data(file_, displays)
+#   print_report()
+#   save_chrome_trace('profile.json')  # Open in chrome://tracing or https://ui.perfetto.dev
+#
+# A stage can be used as a context manager, or started and stopped around code which would be awkward to indent:
+#
+#   with stage('sort', items=len(events)):
+#       events = sorted(events)
+#
+#   profile = stage('ingest').start()
+#   data = process_file(file_)
+#   profile.stop(items=len(data))
+
+g_records = None  # Finished stages, or None if profiling is off.
+g_allocations = False  # Are allocations being traced?
+g_lock = Lock()  # Stages can finish on several threads at once.
+g_time_zero = 0.0
+
+
+class Stage:
+    __slots__ = ('name', 'items', 'wall_start', 'cpu_start', 'memory_start')
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+    def start(self):
+        if g_allocations:
+            from tracemalloc import get_traced_memory
+            self.memory_start = get_traced_memory()[0]
+
+        self.cpu_start = thread_time()
+        self.wall_start = perf_counter()
+
+        return self
+
+    def stop(self, items=None):
+        wall_end = perf_counter()
+        cpu_end = thread_time()
+
+        record = {'name': self.name,
+                  'start': self.wall_start - g_time_zero,
+                  'wall': wall_end - self.wall_start,
+                  'cpu': cpu_end - self.cpu_start,
+                  'items': self.items if items is None else items,
+                  'thread': get_ident()}
+
+        if g_allocations:
+            from tracemalloc import get_traced_memory
+            record['allocated'] = get_traced_memory()[0] - self.memory_start  # Net, so memory freed again doesn't count.
+
+        with g_lock:
+            if g_records is not None:
+                g_records.append(record)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class NullStage:
+    ''' Stands in for a Stage when profiling is off, so instrumented code costs next to nothing. '''
+
+    __slots__ = ()
+
+    items = None
+
+    def start(self):
+        return self
+
+    def stop(self, items=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+def stage(name, items=None):
+    ''' Returns a stage to time, or a stand in which does nothing if profiling is off. '''
+
+    return NULL_STAGE if g_records is None else Stage(name, items)
+
+
+def enable_profiling(allocations=False):
+    ''' Starts recording stages, forgetting any recorded before. Tracing allocations slows everything down a lot. '''
+
+    global g_records
+    global g_allocations
+    global g_time_zero
+
+    assert isinstance(allocations, bool)
+
+    if allocations:
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    g_allocations = allocations
+    g_time_zero = perf_counter()
+    g_records = []
+
+
+def disable_profiling():
+    ''' Stops recording stages, returning those recorded. '''
+
+    global g_records
+    global g_allocations
+
+    records = get_records()
+
+    if g_allocations:
+        import tracemalloc
+        tracemalloc.stop()
+
+    g_records = None
+    g_allocations = False
+
+    return records
+
+
+def get_records():
+    with g_lock:
+        return [] if g_records is None else list(g_records)
+
+
+def get_report(records=None):
+    ''' Returns a dict of stage name -> totals over every time the stage ran. '''
+
+    records = get_records() if records is None else records
+
+    report = {}
+
+    for record in records:
+        totals = report.setdefault(record['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'items': 0, 'allocated': 0})
+
+        totals['calls'] += 1
+        totals['wall'] += record['wall']
+        totals['cpu'] += record['cpu']
+        totals['items'] += record['items'] or 0
+        totals['allocated'] += record.get('allocated', 0)
+
+    return report
+
+
+def print_report(records=None):
+    report = get_report(records)
+
+    print(f'{"Stage":<24} {"Calls":>8} {"Wall (s)":>10} {"CPU (s)":>10} {"Items":>10} {"Alloc (MB)":>11}')
+
+    for name, totals in sorted(report.items(), key=lambda item: -item[1]['wall']):
+        print(f'{name:<24} {totals["calls"]:8d} {totals["wall"]:10.3f} {totals["cpu"]:10.3f} {totals["items"]:10d} '
+              f'{totals["allocated"] / 1024.0 ** 2:11.1f}')
+
+
+def save_chrome_trace(file_, records=None):
+    ''' Saves the stages in the Chrome trace event format, one complete ("X") event per stage. '''
+
+    records = get_records() if records is None else records
+
+    events = [{'name': record['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': record['thread'],
+               'ts': record['start'] * 1e6, 'dur': record['wall'] * 1e6,  # In microseconds.
+               'args': {key: record[key] for key in ('cpu', 'items', 'allocated') if record.get(key) is not None}}
+              for record in records]
+
+    with open(file_, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
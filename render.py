@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+from argparse import ArgumentParser
+
+import numpy as np
+
+from parameters import COLOR_DEFAULT
+from timeline import loadData
+from utility import get_event_arrays
+
+# Example, to dump the frames of a timeline every half a second for a regression check:
+#   python render.py Processed_data/example1 example1.npy --step 0.5
+# And with the mirror displays of a two sided layout, as they are shown on the hardware:
+#   python render.py Processed_data/example1 example1.npy --step 0.5 --layout 4 4 --mirror
+
+
+def render_frames(events, num_displays=None, times=None, size=8, chunk_size=1024, mirror_IDs=None):
+    ''' Replays a timeline without any displays and returns (sample_times, frames), where frames[n, ID]
+        is the size x size frame (indexed [y, x], as in the frame buffer) of display ID at sample n.
+        If times is None, the frames are sampled after every event, otherwise at each of the given times
+        (an event is shown from its start time onwards).
+        If given mirror_IDs, as from display.get_mirror_IDs, each mirror display's frames are its principal's
+        flipped, as they are when uploaded.
+        Rather than applying the events one by one, each chunk of samples is filled in at once: every
+        pixel takes the colour of its most recent update, or keeps the colour from the previous chunk. '''
+
+    assert isinstance(size, int)
+    assert isinstance(chunk_size, int)
+    assert chunk_size > 0
+
+    start_times = np.fromiter((event.start_time for event in events), dtype=float, count=len(events))
+
+    event_indices, pixels, colors = get_event_arrays(events, size)
+
+    if num_displays is None:
+        num_displays = int(pixels.max()) // (size * size) + 1 if len(pixels) > 0 else 0
+
+        if mirror_IDs is not None:
+            num_displays = max(num_displays, max(mirror_IDs) + 1)  # The mirror displays have no events of their own.
+
+    num_pixels = num_displays * size * size
+
+    assert len(pixels) == 0 or pixels.max() < num_pixels, 'Timeline has updates for more displays than requested.'
+
+    # Work out the first sample each pixel update is visible in.
+    if times is None:
+        sample_times = start_times
+        first_samples = event_indices
+    else:
+        sample_times = np.asarray(times, dtype=float)
+        assert (np.diff(sample_times) >= 0.0).all(), 'Sample times should be in order.'
+        first_samples = np.searchsorted(sample_times, start_times[event_indices], side='left')
+
+    # Updates need to be in order of when they become visible, keeping the timeline order for ties.
+    if (np.diff(first_samples) < 0).any():
+        order = np.argsort(first_samples, kind='stable')
+        first_samples, pixels, colors = first_samples[order], pixels[order], colors[order]
+
+    frames = np.empty((len(sample_times), num_pixels), dtype=np.uint8)
+
+    state = np.full(num_pixels, COLOR_DEFAULT, dtype=np.uint8)  # Every display starts cleared.
+    columns = np.arange(num_pixels)
+
+    for start in range(0, len(sample_times), chunk_size):
+        end = min(start + chunk_size, len(sample_times))
+
+        first, last = np.searchsorted(first_samples, [start, end], side='left')
+
+        rows = first_samples[first:last] - start
+        chunk_pixels = pixels[first:last]
+
+        # Only the last update of a pixel within a sample counts, so find the last occurrence of each.
+        keys = rows * num_pixels + chunk_pixels
+        _, reversed_indices = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - reversed_indices
+
+        updated_rows = np.full((end - start, num_pixels), -1, dtype=np.int32)
+        updated_colors = np.zeros((end - start, num_pixels), dtype=np.uint8)
+
+        updated_rows[rows[keep], chunk_pixels[keep]] = rows[keep]
+        updated_colors[rows[keep], chunk_pixels[keep]] = colors[first:last][keep]
+
+        # For every sample and pixel, the row of the most recent update in this chunk (or -1 if there isn't one yet).
+        np.maximum.accumulate(updated_rows, axis=0, out=updated_rows)
+
+        chunk = updated_colors[updated_rows.clip(0), columns]
+        chunk[updated_rows < 0] = np.broadcast_to(state, chunk.shape)[updated_rows < 0]
+
+        frames[start:end] = chunk
+        state = chunk[-1]
+
+    frames = frames.reshape(len(sample_times), num_displays, size, size)
+
+    if mirror_IDs is not None:
+        for ID, mirror_ID in enumerate(mirror_IDs):
+            if mirror_ID >= 0:
+                frames[:, mirror_ID] = frames[:, ID, :, ::-1]  # Flipped horizontally, i.e. each row reversed.
+
+    return sample_times, frames
+
+
+def save_frames(file_, frames):
+    ''' Saves frames from render_frames as a .npy array, or as a .png strip with one row per sample and
+        the displays side by side, coloured with the same colour map as plot_displays. '''
+
+    if file_.lower().endswith('.png'):
+        import matplotlib.pyplot as plt
+
+        num_samples, num_displays, size, _ = frames.shape
+        strip = frames.transpose(0, 2, 1, 3).reshape(num_samples * size, num_displays * size)
+
+        plt.imsave(file_, strip, cmap='jet', vmin=0, vmax=255)
+    else:
+        np.save(file_, frames)
+
+
+def main(args=None):
+    parser = ArgumentParser(description='Render the frames of a pre-processed timeline without any hardware.')
+    parser.add_argument('timeline', help='Pre-processed timeline, as written by storeData.')
+    parser.add_argument('out_file', help='Where to write the frames, .npy or .png.')
+    parser.add_argument('--step', type=float, default=None, help='Sample every STEP seconds rather than after every event.')
+    parser.add_argument('--displays', type=int, default=None, help='Number of displays (default: as many as the timeline uses).')
+    parser.add_argument('--layout', type=int, nargs='+', default=None, help='Layout of the displays, needed with --mirror.')
+    parser.add_argument('--mirror', action='store_true', help='Also render the mirror displays of the layout, from their principal displays.')
+
+    args = parser.parse_args(args)
+
+    mirror_IDs = None
+
+    if args.mirror:
+        from display import get_mirror_IDs, get_sim_displays
+
+        assert args.layout is not None, 'Need the layout to know which displays are mirrors.'
+
+        mirror_IDs = get_mirror_IDs(get_sim_displays(layout=tuple(args.layout), mirror=True))
+
+    events = loadData(args.timeline)
+
+    times = None
+
+    if args.step is not None and len(events) > 0:
+        assert args.step > 0.0, 'Step should be > 0.0.'
+        times = np.arange(events[0].start_time, events[-1].start_time + args.step, args.step)
+
+    sample_times, frames = render_frames(events, num_displays=args.displays, times=times, mirror_IDs=mirror_IDs)
+
+    save_frames(args.out_file, frames)
+
+    print(f'Rendered {len(sample_times)} samples of {frames.shape[1]} displays to {args.out_file}')
+
+
+if __name__ == '__main__':
+    main()
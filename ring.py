@@ -0,0 +1,118 @@
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from struct import calcsize, pack_into, unpack_from
+
+from parameters import ANIMATION_FRAMES_MAX, RING_RECORDS, RING_WAIT
+
+# Each record is: the wall clock time the frame was queued, the display ID, how many pixels changed, the number of
+# frames (0 for a single frame which is shown until the next, otherwise an animation) and the animation's frame
+# duration, followed by room for the largest animation.
+RECORD_HEADER = '<dHHB3xd'
+RECORD_HEADER_SIZE = calcsize(RECORD_HEADER)
+
+END_OF_FRAMES = 0xFFFF  # Display ID of the record which tells the reader there are no more frames.
+
+
+class FrameRing:
+    ''' A ring buffer of fixed size frame records in shared memory, so one process can hand frames to another without
+        pickling them or sharing a GIL. There must be exactly one writer and one reader. Two semaphores count the free
+        and filled records, so the writer only waits if the ring is full, and the reader can wait for frames without
+        spinning. They also make sure a record has been completely written before the reader sees it. '''
+
+    def __init__(self, num_records=RING_RECORDS, size=8, context=None):
+        assert isinstance(num_records, int)
+        assert num_records > 0, 'Ring needs at least one record.'
+
+        context = get_context() if context is None else context
+
+        self.num_records = num_records
+        self.frame_size = size * size
+        self.record_size = RECORD_HEADER_SIZE + ANIMATION_FRAMES_MAX * self.frame_size
+
+        self.memory = SharedMemory(create=True, size=num_records * self.record_size)
+
+        self.free = context.Semaphore(num_records)  # Records the writer can fill.
+        self.filled = context.Semaphore(0)  # Records waiting for the reader.
+
+        self.write_index = 0  # Only used by the writer...
+        self.read_index = 0  # ... and this only by the reader.
+
+        # If set, write stops waiting for room in a full ring once this returns True, e.g. as the reader has died.
+        self.give_up = None
+
+    def wait_for_record(self, give_up=None):
+        ''' Takes a free record, waiting for one if the ring is full. Returns False, without one, if give_up() says
+            to stop waiting. '''
+
+        if self.free.acquire(block=False):
+            return True
+
+        while give_up is None or not give_up():
+            if self.free.acquire(timeout=RING_WAIT):
+                return True
+
+        return False
+
+    def write(self, ID, frame, animation=None, changes=0, queued=0.0):
+        ''' Adds a frame for display ID, or an animation of (frames, duration) starting from it. Returns False if the
+            frame was dropped, as the ring was full and give_up said to stop waiting. '''
+
+        return self.write_record(ID, frame, animation, changes, queued, self.give_up)
+
+    def write_end(self, give_up=None):
+        ''' Tells the reader there are no more frames. Only gives up waiting for room if give_up() says to. '''
+
+        return self.write_record(END_OF_FRAMES, [0] * self.frame_size, give_up=give_up)
+
+    def write_record(self, ID, frame, animation=None, changes=0, queued=0.0, give_up=None):
+        frames, duration = ([frame], 0.0) if animation is None else animation
+
+        assert len(frames) <= ANIMATION_FRAMES_MAX
+
+        if not self.wait_for_record(give_up):
+            return False
+
+        offset = (self.write_index % self.num_records) * self.record_size
+
+        pack_into(RECORD_HEADER, self.memory.buf, offset, queued, ID, min(changes, 0xFFFF),
+                  0 if animation is None else len(frames), duration)
+
+        offset += RECORD_HEADER_SIZE
+
+        for f in frames:
+            self.memory.buf[offset:offset + self.frame_size] = bytes(f)
+            offset += self.frame_size
+
+        self.write_index += 1
+
+        self.filled.release()
+
+        return True
+
+    def read(self, timeout=None):
+        ''' Returns the next record as (ID, frame, animation, changes, queued), or None if there isn't one within timeout.
+            After the writer's write_end, the ID is END_OF_FRAMES. '''
+
+        if not self.filled.acquire(timeout=timeout):
+            return None
+
+        offset = (self.read_index % self.num_records) * self.record_size
+
+        queued, ID, changes, num_frames, duration = unpack_from(RECORD_HEADER, self.memory.buf, offset)
+
+        offset += RECORD_HEADER_SIZE
+
+        frames = [list(self.memory.buf[offset + n * self.frame_size:offset + (n + 1) * self.frame_size])
+                  for n in range(max(num_frames, 1))]
+
+        self.read_index += 1
+
+        self.free.release()
+
+        return ID, frames[0], None if num_frames == 0 else (frames, duration), changes, queued
+
+    def close(self, unlink=False):
+        self.memory.close()
+
+        if unlink:
+            self.memory.unlink()
@@ -0,0 +1,77 @@
+import numpy as np
+
+from display import get_display_IDs
+from utility import get_event_arrays
+
+# Example, to see how often each pixel was hit and updated while pre-processing:
+#   events = process_data(file_, displays, stats_file='example1_stats.npz')
+#   print_stats(load_stats('example1_stats.npz'))
+
+
+def get_hit_stats(data, displays):
+    ''' Takes the raw data and returns (hits, energy): the number of hits on each pixel of every display and
+        their total energy, as arrays indexed [ID, y, x] (as in the frame buffer). Hits are only counted on the
+        main displays, as the mirror displays show the same thing. '''
+
+    size = displays[0].size
+    num_pixels = (max(display.ID for display in displays) + 1) * size * size
+
+    x = data['x'].to_numpy(dtype=int)
+    y = data['y'].to_numpy(dtype=int)
+
+    display_IDs, _ = get_display_IDs(displays, x, y, data['side'].to_numpy(dtype=int))
+
+    keep = display_IDs >= 0  # Hits which don't map to a display aren't shown, so aren't counted.
+
+    pixels = display_IDs[keep] * size * size + x[keep] % size + size * (y[keep] % size)
+
+    hits = np.bincount(pixels, minlength=num_pixels)
+    energy = np.bincount(pixels, weights=data['energy'].to_numpy(dtype=float)[keep], minlength=num_pixels)
+
+    return hits.reshape(-1, size, size), energy.reshape(-1, size, size)
+
+
+def get_update_stats(events, displays):
+    ''' Returns the number of times each pixel of every display is updated by the events, indexed [ID, y, x]. '''
+
+    size = displays[0].size
+    num_pixels = (max(display.ID for display in displays) + 1) * size * size
+
+    _, pixels, _ = get_event_arrays(events, size)
+
+    return np.bincount(pixels, minlength=num_pixels).reshape(-1, size, size)
+
+
+def get_stats(data, events, displays):
+    ''' Returns a dict of the per-pixel 'hits', 'energy' and 'updates' of every display, each indexed [ID, y, x].
+        Summing over the last two axes gives the per-display totals. '''
+
+    assert len({display.size for display in displays}) == 1, 'Can currently only work with all displays of equal size.'
+
+    hits, energy = get_hit_stats(data, displays)
+
+    return {'hits': hits, 'energy': energy, 'updates': get_update_stats(events, displays)}
+
+
+def save_stats(file_, stats):
+    np.savez(file_, **stats)
+
+
+def load_stats(file_):
+    with np.load(file_) as f:
+        return {name: f[name] for name in f.files}
+
+
+def print_stats(stats, IDs=None, show_maps=False):
+    ''' Prints the totals of each display, and optionally their per-pixel maps of updates. '''
+
+    if IDs is None:
+        IDs = range(len(stats['hits']))
+
+    print(f'{"Display":>8} {"Hits":>10} {"Energy":>12} {"Updates":>10}')
+
+    for ID in IDs:
+        print(f'{ID:8d} {stats["hits"][ID].sum():10d} {stats["energy"][ID].sum():12.1f} {stats["updates"][ID].sum():10d}')
+
+        if show_maps:
+            print(stats['updates'][ID])
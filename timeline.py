@@ -0,0 +1,239 @@
+from bisect import bisect_right
+
+from parameters import ANIMATION_FRAMES_MAX, ANIMATION_TIME_TOLERANCE, COLOR_DEFAULT, TIMELINE_CHECKPOINT_INTERVAL
+
+
+def storeData(data, _file='example'):
+    ''' Function to store preprocessed event data in a file for displaying later. The data is written
+        to a temporary file first and then moved into place, so the file is never left half written. '''
+    import os
+    import pickle
+    from tempfile import NamedTemporaryFile
+    print(f"Dumping processed data to file: {_file}" )
+    # Dump data to a temporary file in the same directory, so the final rename stays on one file system.
+    dbfile = NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(_file)), delete=False)
+    try:
+        pickle.dump(data, dbfile)
+        dbfile.close()
+        os.replace(dbfile.name, _file)
+    except BaseException:
+        dbfile.close()
+        os.unlink(dbfile.name)
+        raise
+    print('Done')
+    return
+
+
+def loadData(_file='example'):
+    ''' Function to load preprocessed event data from file for displaying.'''
+    import pickle
+    print(f"Loading processed data from file: {_file}" )
+    dbfile = open(_file, 'rb')    
+    data = pickle.load(dbfile)
+    dbfile.close()
+    print('Done')
+    return data
+
+
+class Timeline:
+    ''' A list of events with a time index, so playback can start from any time without replaying all the events
+        before it. Every `interval` events a checkpoint is kept of the frames of all the displays (one byte per pixel,
+        display after display), and seeking replays at most `interval` events on top of the nearest one. '''
+
+    def __init__(self, events, num_displays=None, size=8, interval=TIMELINE_CHECKPOINT_INTERVAL, checkpoints=None):
+        assert isinstance(size, int)
+        assert isinstance(interval, int)
+        assert interval > 0, 'Checkpoint interval should be > 0.'
+
+        if num_displays is None:
+            num_displays = 1 + max((max(event.display_IDs) for event in events if len(event.display_IDs) > 0), default=-1)
+
+        self.events = events
+        self.num_displays = num_displays
+        self.size = size
+        self.interval = interval
+        self.start_times = [event.start_time for event in events]
+
+        self.checkpoints = self.get_checkpoints() if checkpoints is None else checkpoints
+
+        assert len(self.checkpoints) == (len(events) + interval - 1) // interval, 'Checkpoints do not match the events.'
+
+    def apply_events(self, state, start, end):
+        ''' Applies the events from index start up to (not including) end to the frames in state. '''
+
+        pixels = self.size * self.size
+
+        for event in self.events[start:end]:
+            for x, y, color, ID in event:
+                state[ID * pixels + x + self.size * y] = color
+
+    def get_checkpoints(self):
+        state = bytearray([COLOR_DEFAULT]) * (self.num_displays * self.size * self.size)  # Every display starts cleared.
+
+        checkpoints = []
+
+        for start in range(0, len(self.events), self.interval):
+            checkpoints.append(bytes(state))  # The frames just before event `start`.
+
+            self.apply_events(state, start, start + self.interval)
+
+        return checkpoints
+
+    def get_state(self, n):
+        ''' Returns the frames of all the displays after the first n events. '''
+
+        assert 0 <= n <= len(self.events)
+
+        if len(self.checkpoints) == 0:  # No events at all.
+            return bytearray([COLOR_DEFAULT]) * (self.num_displays * self.size * self.size)
+
+        checkpoint = min(n // self.interval, len(self.checkpoints) - 1)  # The last checkpoint at or before n.
+
+        state = bytearray(self.checkpoints[checkpoint])
+
+        self.apply_events(state, checkpoint * self.interval, n)
+
+        return state
+
+    def seek(self, t):
+        ''' Returns (n, frames): the index of the first event after time t, where playback should carry on from, and
+            the frame of each display (indexed by ID) at time t, i.e. once every event up to and including t is shown. '''
+
+        n = bisect_right(self.start_times, t)
+
+        state = self.get_state(n)
+
+        pixels = self.size * self.size
+
+        return n, [list(state[ID * pixels:(ID + 1) * pixels]) for ID in range(self.num_displays)]
+
+
+def load_timeline(_file, num_displays=None, size=8, interval=TIMELINE_CHECKPOINT_INTERVAL, events=None):
+    ''' Loads a stored timeline with its time index, or just the index if its events have already been loaded.
+        The index is kept next to the timeline in `<file>.index`, and is only rebuilt if the timeline has changed
+        since or was indexed differently. '''
+    import os
+    import pickle
+
+    if events is None:
+        events = loadData(_file)
+
+    stat = os.stat(_file)
+    settings = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'num_displays': num_displays,
+                'display_size': size, 'interval': interval}
+
+    index_file = _file + '.index'
+
+    try:
+        with open(index_file, 'rb') as f:
+            index = pickle.load(f)
+
+        if index['settings'] == settings:
+            return Timeline(events, index['num_displays'], size, interval, checkpoints=index['checkpoints'])
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, AssertionError):
+        pass
+
+    timeline = Timeline(events, num_displays, size, interval)
+
+    # Written to a temporary file first, as in storeData. It's only a cache, so it doesn't matter if this fails.
+    try:
+        with open(index_file + '.tmp', 'wb') as f:
+            pickle.dump({'settings': settings, 'num_displays': timeline.num_displays, 'checkpoints': timeline.checkpoints}, f)
+
+        os.replace(index_file + '.tmp', index_file)
+    except OSError as error:
+        print(f'Warning: could not save the time index {index_file}: {error}')
+
+    return timeline
+
+
+def get_animations(events, size=8, max_frames=ANIMATION_FRAMES_MAX, tolerance=ANIMATION_TIME_TOLERANCE):
+    ''' Finds runs of updates to a display at a steady interval, e.g. a pixel fading out tick by tick, which
+        can be uploaded once and played by the matrix itself. Returns a dict of (event index, display ID)
+        -> (frames, interval) for where each animation starts, and a set of the (event index, display ID)
+        updates that are covered by an animation and so don't need uploading.
+        An animation is only used if the display is updated again exactly when it finishes, so the
+        matrix never runs out of frames to show. '''
+
+    assert isinstance(max_frames, int)
+    assert max_frames > 1
+
+    # First, play through the events to get the time and frame of every update of each display.
+    frames = {}
+    updates = {}
+
+    for n, event in enumerate(events):
+        updated_display_IDs = set(event.display_IDs)
+
+        for ID in updated_display_IDs:
+            if ID not in frames:
+                frames[ID] = [COLOR_DEFAULT] * size * size
+                updates[ID] = []
+
+        for x, y, color, ID in event:
+            frames[ID][x + size * y] = color
+
+        for ID in updated_display_IDs:
+            updates[ID].append((n, event.start_time, list(frames[ID])))
+
+    animations = {}
+    covered = set()
+
+    for ID, display_updates in updates.items():
+        n = 0
+
+        while n < len(display_updates) - 2:
+            interval = display_updates[n+1][1] - display_updates[n][1]
+
+            # Extend the run while the updates keep to the interval, one past the frames so we know the next update does too.
+            m = n + 1
+
+            while m < len(display_updates) and m - n <= max_frames and \
+                  abs(display_updates[m][1] - display_updates[m-1][1] - interval) < tolerance:
+                m += 1
+
+            run = display_updates[n:m-1]  # The last update in the run is the one which follows the animation.
+
+            if len(run) > 1 and 0.001 < interval <= 65.535:  # The duration sent to the matrix is in ms and must fit into 2 bytes.
+                animations[(run[0][0], ID)] = ([frame for _, _, frame in run], interval)
+                covered.update((index, ID) for index, _, _ in run[1:])
+
+                n += len(run)
+            else:
+                n += 1
+
+    return animations, covered
+
+
+class Event:
+    # Slotted to keep long timelines small in memory. The values are checked by data.validate_events when validating.
+    __slots__ = ('x_values', 'y_values', 'colors', 'display_IDs', 'start_time')
+
+    def __init__(self, x_values, y_values, colors, display_IDs, start_time=0.0):
+        self.x_values = x_values  # These are the local x co-ordinates.
+        self.y_values = y_values  # These are the local y co-ordinates.
+        self.colors = colors
+        self.display_IDs = display_IDs
+        self.start_time = start_time
+
+    def __setstate__(self, state):
+        # Timelines stored before Event was slotted hold a plain dict of attributes rather than (dict, slots).
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __iter__(self):
+        return iter(zip(self.x_values, self.y_values, self.colors, self.display_IDs))
+
+    def __lt__(self, other):
+        return self.start_time < other.start_time
+
+    def __repr__(self):
+        s = ''
+
+        for x, y, color, display_ID in self:
+            s += f'({x},{y})  {color}  {self.start_time:6.2f}\n'
+
+        return s[:-1]
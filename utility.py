@@ -1,7 +1,7 @@
-from numpy import ceil, cos, sin, isclose
+from math import ceil, cos, sin
 from time import sleep
 
-from parameters import GRADIENT_DELAY, WAIT_INITIAL, PI
+from parameters import COLOR_DEFAULT, GRADIENT_DELAY, WAIT_INITIAL, PI
 
 
 def wait_for_matrix_ready():
@@ -51,6 +51,65 @@ def get_color_from_gradient(quantity, color_gradient, total_points=100):
     return max_c #colors[0]  # If we the quantity doesn't fit anywhere, assume it is the highest quantity colour.
 
 
+def get_colors_from_gradient(quantities, color_gradient, total_points=100):
+    ''' Array version of get_color_from_gradient, which returns the colours for a whole array of
+        quantities at once. Quantities which are <= 0 are given the default colour. '''
+
+    from numpy import asarray, zeros  # Only needed when pre-processing, so kept off the playback import path.
+
+    assert isinstance(total_points, int)
+
+    quantities = asarray(quantities, dtype=float)
+
+    bounds, colors = color_gradient
+
+    scaled_quantities = 100 * quantities / (total_points / 2)
+
+    # Anything which doesn't fit into a bound gets the highest quantity colour, as in get_color_from_gradient.
+    result = zeros(quantities.shape, dtype=int)
+
+    # Going from the first bound to the last means the smallest bound a quantity fits into is applied last,
+    # which matches get_color_from_gradient looping from the smallest bound and returning the first match.
+    for upper_bound, color in zip(bounds, colors):
+        result[scaled_quantities <= upper_bound] = color
+
+    result[quantities <= 0.0] = COLOR_DEFAULT
+
+    return result
+
+
+def get_event_arrays(events, size=8):
+    ''' Flattens the events into arrays with one entry per pixel update: the index of the event it
+        came from, the pixel (display ID * size * size + x + size * y) and the colour. '''
+
+    from itertools import chain
+    from numpy import arange, fromiter, int64, repeat, uint8  # Only needed off the playback path, as for get_colors_from_gradient.
+
+    counts = fromiter((len(event.display_IDs) for event in events), dtype=int64, count=len(events))
+
+    event_indices = repeat(arange(len(events)), counts)
+
+    x_values = fromiter(chain.from_iterable(event.x_values for event in events), dtype=int64)
+    y_values = fromiter(chain.from_iterable(event.y_values for event in events), dtype=int64)
+    display_IDs = fromiter(chain.from_iterable(event.display_IDs for event in events), dtype=int64)
+    colors = fromiter(chain.from_iterable(event.colors for event in events), dtype=uint8)
+
+    pixels = display_IDs * size * size + x_values + size * y_values
+
+    return event_indices, pixels, colors
+
+
+def get_peak_memory():
+    ''' Returns the peak resident memory of this process so far, in MB. '''
+
+    from resource import getrusage, RUSAGE_SELF
+    from sys import platform
+
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024.0 ** 2 if platform == 'darwin' else peak / 1024.0  # Bytes on macOS, KB elsewhere.
+
+
 def get_num_ticks(quantity, rate):
     ''' Gets the number of ticks needed to take a quantity down to 0.
         E.g if we have 18eV and a tick rate of 5eV, then it will take